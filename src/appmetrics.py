@@ -16,13 +16,25 @@ counter, flag, and gauge functions.
 """
 
 import sys
-from functools import partial
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from json import dumps as jdumps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from os import getpgrp, getppid, killpg
 from threading import Lock, Thread
 from time import monotonic, process_time, time
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    from orjson import OPT_INDENT_2
+    from orjson import dumps as _jdumpb
+
+    def jdumpb(obj: Any) -> bytes:
+        return _jdumpb(obj, option=OPT_INDENT_2)
+
+except ImportError:
+    from json import dumps as _jdumps
+
+    def jdumpb(obj: Any) -> bytes:
+        return _jdumps(obj, indent=1).encode()
+
 
 Number = Union[int, float]
 
@@ -79,6 +91,9 @@ class AppMetrics:
             return
         self.am_mutex: Lock = Lock()
         self._stats: Dict[str, Any] = {P: {"pid": getppid(), "appname": appname}, C: {}, F: {}, G: {}}
+        # The dashboard only depends on which metrics exist, so it is cached until another one is created
+        self._metrics_version: int = 0
+        self._index_html: Optional[Tuple[int, bytes]] = None
         self._init_real_time = monotonic()
         self._wall_time = time()
         self._init_proc_time = process_time()
@@ -92,10 +107,10 @@ class AppMetrics:
         self._stats[P]["proc"] = process_time() - self._init_proc_time
 
     def get_stats(self) -> Dict[str, Any]:
-        "return a copy of the latest statistics."
+        "return a copy of the latest statistics, which can be serialized without holding the lock."
         with self.am_mutex:
             self._set_clocks()
-            return self._stats.copy()
+            return {k: v.copy() for k, v in self._stats.items()}
 
     def close(self) -> None:
         self._server._close()
@@ -104,6 +119,8 @@ class AppMetrics:
     def counter_create(self, name: str, init_val: Number = 0):
         return self._create_metric(C, name, init_val)
 
+    # Updating a counter is a read-modify-write which can be interleaved with another thread, so
+    # counters need the lock. Flags and gauges are a single store, which the GIL already makes atomic.
     def counter_increment(self, name: str, step=1):
         with self.am_mutex:
             self._stats[C][name] += step
@@ -117,13 +134,12 @@ class AppMetrics:
         self._create_metric(F, name, init_val)
 
     def flag_setval(self, name: str, v: bool):
-        with self.am_mutex:
-            if name not in self._stats[F]:
-                raise KeyError(f"flag:{name}")
-            if isinstance(v, bool):
-                self._stats[F][name] = v
-            else:
-                raise ValueError
+        if name not in self._stats[F]:
+            raise KeyError(f"flag:{name}")
+        if type(v) is bool:
+            self._stats[F][name] = v
+        else:
+            raise ValueError
 
     def flag_set(self, name: str):
         self.flag_setval(name, True)
@@ -136,13 +152,13 @@ class AppMetrics:
         self._create_metric(G, name, init_val)
 
     def gauge_update(self, name: str, v: Number):
-        with self.am_mutex:
-            if name not in self._stats[G]:
-                raise KeyError(f"gauge:{name}")
-            if isinstance(v, int) or isinstance(v, float):
-                self._stats[G][name] = v
-            else:
-                raise ValueError
+        "Set a gauge to a number. bool is a subclass of int, so True and False are accepted as 1 and 0."
+        if name not in self._stats[G]:
+            raise KeyError(f"gauge:{name}")
+        if isinstance(v, (int, float)):
+            self._stats[G][name] = v
+        else:
+            raise ValueError
 
     def _create_metric(self, mtype: str, name: str, init_val: Any):
         if mtype not in self._mtypes:
@@ -150,6 +166,7 @@ class AppMetrics:
         with self.am_mutex:
             if name not in self._stats[mtype]:
                 self._stats[mtype][name] = init_val
+                self._metrics_version += 1
             else:
                 raise ValueError(f"{mtype}:{name} already exists")
 
@@ -157,22 +174,34 @@ class AppMetrics:
 class AppMetricsBaseReqHandler(BaseHTTPRequestHandler):
     """ """
 
-    def __init__(self, metrics: AppMetrics, *args, **kwargs):
-        self.metrics = metrics
-        super().__init__(*args, **kwargs)
+    # responses are small, don't let Nagle hold them back waiting for an ACK
+    disable_nagle_algorithm = True
+
+    # Set on a per-server subclass, see AppMetricsServer._make_http_thread()
+    metrics: AppMetrics
+
+    def index_html(self) -> bytes:
+        "Get the dashboard page, only rebuilding it if metrics have been created since it was last built"
+        version = self.metrics._metrics_version
+        cached = self.metrics._index_html
+        if cached is None or cached[0] != version:
+            # If a metric is created while this is running, the version won't match next time either.
+            cached = (version, self._make_index_html().encode())
+            self.metrics._index_html = cached
+        return cached[1]
 
-    def index_html(self) -> str:
-        kz = self.metrics._stats.keys()
+    def _make_index_html(self) -> str:
+        stats = self.metrics.get_stats()
 
         lines = [
             "<html> <body> <tt>",
             '<table id="mtx" border="1" cellpadding="2"><h2>Application Metrics</h2></td>',
         ]
 
-        for k in self.metrics._stats:
+        for k in stats:
             tr = f'<tr><td colspan="2" id="{k}"><b>{k.upper()}</b></tr></td>'
             lines.append(tr)
-            for m in self.metrics._stats[k]:
+            for m in stats[k]:
                 n = m
                 if m == "wall":
                     n = "current time"
@@ -223,9 +252,9 @@ class AppMetricsBaseReqHandler(BaseHTTPRequestHandler):
             shutdown = True
         if self.path.startswith("/web"):
             content_type = "text/html"
-            content = self.index_html().encode()
+            content = self.index_html()
         else:
-            content = jdumps(self.metrics.get_stats(), indent=1).encode() + b"\r\n"
+            content = jdumpb(self.metrics.get_stats()) + b"\r\n"
 
         self.send_response(200)
         self.send_header("Content-Type", content_type)
@@ -253,19 +282,22 @@ class AppMetricsServer:
             name="varz_server",
         )
         self._server_thread.start()
-        self._server: Optional[HTTPServer] = None
+        self._server: Optional[ThreadingHTTPServer] = None
 
     def __del__(self) -> None:
         self._close()
 
     def _make_http_thread(self, server_address, metrics: AppMetrics) -> None:
         print(f"Starting AppMetrics server on {server_address}", file=sys.stderr)
-        AppMetricsReqHandler = partial(AppMetricsBaseReqHandler, metrics)
-        self._server = HTTPServer(server_address=server_address, RequestHandlerClass=AppMetricsReqHandler)
+        # The metrics are a class attribute, so nothing extra needs to happen as each request is handled
+        AppMetricsReqHandler = type("AppMetricsReqHandler", (AppMetricsBaseReqHandler,), {"metrics": metrics})
+        # A slow or stuck client shouldn't block everyone else. Request threads are daemonic, so they don't
+        # hold up shutdown either, and the address can be reused immediately after a restart.
+        self._server = ThreadingHTTPServer(server_address=server_address, RequestHandlerClass=AppMetricsReqHandler)
         self._server.serve_forever()
 
     def _close(self) -> None:
-        if self._server and isinstance(self._server, HTTPServer):
+        if self._server and isinstance(self._server, ThreadingHTTPServer):
             self._server.shutdown()
             self._server.server_close()
             self._server = None
@@ -4,24 +4,30 @@
 # Author: Chris Kuethe <chris.kuethe@gmail.com> , https://github.com/ckuethe/radiacode-tools
 # SPDX-License-Identifier: MIT
 
-import json
 import os
 from argparse import ArgumentParser, Namespace
+from json import JSONDecodeError
+from math import comb
 from sys import exit
 from tempfile import mkstemp
-from typing import Iterable, List, NoReturn, Tuple
+from typing import Iterable, List, NoReturn
 
-from numpy import corrcoef
-from numpy.polynomial import Polynomial
+import numpy as np
+from numpy.polynomial.polynomial import polyval
 
 from rctypes import Number
 
+try:
+    # orjson parses considerably faster, and its decode error subclasses the stdlib one
+    from orjson import loads as jloads
+except ImportError:
+    from json import loads as jloads
 
-def template_calibration(args: Namespace) -> NoReturn:
-    # RC-102 is roughly 2.8 keV per channel. This is a sample calibration;
-    # measure some with your own device and fill in the appropriate channel
-    # numbers.
-    blob = """{
+
+# RC-102 is roughly 2.8 keV per channel. This is a sample calibration;
+# measure some with your own device and fill in the appropriate channel
+# numbers.
+_TEMPLATE_CALIBRATION = b"""{
   "unobtainium": "Remove this line after filling in actual calibration measurements. The channel mapping below is a rough (aka. wrong) linear model...",
   "americium": [
     { "energy": 26, "channel": 9 },
@@ -64,21 +70,22 @@ def template_calibration(args: Namespace) -> NoReturn:
     { "energy": 2614, "channel": 941 }
   ]
 }
-    """
+"""
+
 
+def template_calibration(args: Namespace) -> NoReturn:
     if os.path.exists(args.cal_file):
         print(f"Output file '{args.cal_file}' already exists")
-    tfd, tfn = mkstemp()
-    os.close(tfd)
-    with open(tfn, "w") as ofd:
-        ofd.write(blob)
     # deepcode ignore PT: CLI tool, intentionally accepts user paths
-    os.rename(tfn, args.cal_file)
+    tfd, tfn = mkstemp(dir=os.path.dirname(os.path.abspath(args.cal_file)))
+    os.write(tfd, _TEMPLATE_CALIBRATION)
+    os.close(tfd)
+    os.replace(tfn, args.cal_file)
 
     exit(0)
 
 
-def load_calibration(args: Namespace) -> List[Tuple[Number, Number]]:
+def load_calibration(args: Namespace) -> np.ndarray:
     """
     Calibration file is a json file which contains a dict like this:
 
@@ -96,19 +103,17 @@ def load_calibration(args: Namespace) -> List[Tuple[Number, Number]]:
             ],
     }
 
+    The calibration points are returned as an Nx2 array of (channel, energy), sorted by channel.
     """
-    rv = []
     # file deepcode ignore PT: CLI too, intentionally opening the file the user asked for
-    with open(args.cal_file) as ifd:
-        data = json.load(ifd)
-    for element in data:
-        for cal_point in data[element]:
-            rv.append((cal_point["channel"], cal_point["energy"]))
-
-    rv.sort(key=lambda x: x[0])
+    with open(args.cal_file, "rb") as ifd:
+        data = jloads(ifd.read())
+    rv = np.array([(p["channel"], p["energy"]) for pts in data.values() for p in pts], dtype=np.float64)
+    rv = rv.reshape(-1, 2)
+    rv = rv[rv[:, 0].argsort(kind="stable")]
     # It may help the polynomial fit to force a 0/0 data point.
-    if args.zero_start and rv[0] != (0, 0):
-        rv.insert(0, (0, 0))
+    if args.zero_start and rv[0, 0] != 0:
+        rv = np.vstack(([0, 0], rv))
     return rv
 
 
@@ -164,6 +169,13 @@ def get_args() -> Namespace:
     return ap.parse_args()
 
 
+def _r2(x: np.ndarray, y: np.ndarray, coeffs: Iterable[Number]) -> float:
+    "Quietly compute the coefficient of determination, so it can be called in a loop over fit parameters"
+    res = y - polyval(x, coeffs)
+    dev = y - y.mean()
+    return float(1.0 - (res @ res) / (dev @ dev))
+
+
 def rsquared(xlist: Iterable[Number], ylist: Iterable[Number], coeffs: Iterable[Number]) -> float:
     """
     Compute R^2 for the fit model
@@ -171,19 +183,34 @@ def rsquared(xlist: Iterable[Number], ylist: Iterable[Number], coeffs: Iterable[
     xlist: an array of x-axis values
     ylist: an array of y-value measurements of the same dimension as xlist
     coeffs: an iterable of polynomial coefficients, least significant first (x^0, x^1, .. , x^n)
+
+    This is the coefficient of determination (1 - SSres/SStot) rather than the squared
+    correlation coefficient, which ignores any bias in the fit.
     """
-    chan2kev = Polynomial(coeffs)
-    computed: List[Number] = [chan2kev(i) for i in xlist]
-    corr_matrix = corrcoef(ylist, computed)
-    r_squared = corr_matrix[0, 1] ** 2
+    r_squared = _r2(np.asarray(xlist, dtype=np.float64), np.asarray(ylist, dtype=np.float64), coeffs)
 
     print(f"R^2: {r_squared:.5f}")
     return r_squared
 
 
 def make_fit(chan, energy, args) -> List[float]:
-    pf = Polynomial.fit(chan, energy, deg=args.order, window=[min(chan), max(chan)]).coef
-    pf = [round(f, args.precision) for f in pf]
+    """
+    Least squares polynomial fit of energy as a function of channel.
+
+    The channels are centered before solving to keep the Vandermonde matrix reasonably
+    well conditioned, and the coefficients are then translated back to powers of x.
+    """
+    x = np.asarray(chan, dtype=np.float64)
+    xm = x.mean()
+    vander = np.vander(x - xm, args.order + 1, increasing=True)
+    cc, *_ = np.linalg.lstsq(vander, np.asarray(energy, dtype=np.float64), rcond=None)
+
+    # binomial expansion of sum(c_k * (x - xm)^k)
+    pf = np.zeros(args.order + 1)
+    for k, c in enumerate(cc):
+        for j in range(k + 1):
+            pf[j] += c * comb(k, j) * (-xm) ** (k - j)
+    pf = [round(float(f), args.precision) for f in pf]
     print(f"x^0 .. x^{args.order}: {pf}")
     return pf
 
@@ -199,12 +226,12 @@ def main() -> None:
     except FileNotFoundError:
         print(f"Calibration file '{args.cal_file}' does not exist")
         exit(1)
-    except (TypeError, json.JSONDecodeError):
+    except (TypeError, JSONDecodeError):
         print(f"Data format error loading calibration file")
         exit(1)
-    chan, energy = zip(*data)
+    chan, energy = data[:, 0], data[:, 1]
 
-    print(f"data range: {data[0]} - {data[-1]}")
+    print(f"data range: {data[0].tolist()} - {data[-1].tolist()}")
     pf = make_fit(chan, energy, args)
     rsquared(chan, energy, pf)
 
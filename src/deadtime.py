@@ -4,8 +4,10 @@
 # Author: Chris Kuethe <chris.kuethe@gmail.com> , https://github.com/ckuethe/radiacode-tools
 # SPDX-License-Identifier: MIT
 
+import os
 from argparse import ArgumentParser, Namespace
-from math import pow, sqrt
+from functools import lru_cache
+from math import sqrt
 from typing import Dict, Union
 
 from rcfiles import RcSpectrum
@@ -29,40 +31,43 @@ def get_args() -> Namespace:
     return ap.parse_args()
 
 
-def load_spectra(args) -> Dict[str, float]:
-    rv = {}
+def get_rate_from_spectrum(filename: str) -> float:
+    "Load a spectrum file and return its foreground count rate"
+    return _rate_from_file(filename, os.path.getmtime(filename))
 
-    try:
-        rv["a"] = float(args.first) / args.interval
-    except ValueError:
-        # file deepcode ignore PT: CLI tool intentionally opening the files the user asked for
-        rv["a"] = RcSpectrum(args.first).count_rate()
 
-    try:
-        rv["b"] = float(args.second) / args.interval
-    except ValueError:
-        rv["b"] = RcSpectrum(args.second).count_rate()
+@lru_cache(maxsize=16)
+def _rate_from_file(filename: str, mtime: float) -> float:
+    "Return the foreground count rate of a spectrum file, as of the given modification time"
+    # file deepcode ignore PT: CLI tool intentionally opening the files the user asked for
+    return RcSpectrum(filename).count_rate()
 
-    try:
-        rv["ab"] = float(args.combined) / args.interval
-    except ValueError:
-        rv["ab"] = RcSpectrum(args.combined).count_rate()
 
-    if args.background is not None:
+def _as_rate(s: str, interval: float) -> float:
+    "Interpret an argument as a number of counts per interval, or failing that, a spectrum file"
+    if s and s[0] in "0123456789+-.":  # don't bother trying to parse most paths as numbers
         try:
-            rv["bg"] = float(args.background) / args.interval
+            return float(s) / interval
         except ValueError:
-            rv["bg"] = RcSpectrum(args.background).count_rate()
-    else:
-        rv["bg"] = 0
+            pass
+    return get_rate_from_spectrum(s)
+
+
+def load_spectra(args) -> Dict[str, float]:
+    rv = {
+        "a": _as_rate(args.first, args.interval),
+        "b": _as_rate(args.second, args.interval),
+        "ab": _as_rate(args.combined, args.interval),
+        "bg": 0 if args.background is None else _as_rate(args.background, args.interval),
+    }
 
     print(f"Computing deadtime from a={args.first}, b={args.second}, ab={args.combined}")
 
     return rv
 
 
-# I know: x**2 == math.pow(x,2) , and x**0.5 == math.sqrt(x)
-# but sqrt(x) is nicer to read than x**0.5, so I might as well use pow() too
+# I know: x**0.5 == math.sqrt(x), but sqrt(x) is nicer to read. Squaring is
+# just X * X though; math.pow() goes through the general libm power function.
 #
 # Knoll recommends use of sources with enough activity such that tau * ab >= 20%
 # https://www.amazon.com/Radiation-Detection-Measurement-Glenn-Knoll/dp/0470131489
@@ -80,12 +85,12 @@ def compute_deadtime(*, a: Number, b: Number, ab: Number, bg: Number = 0) -> DTs
     if bg < 0:
         raise ValueError("Background cannot be negative")
 
-    if any([a <= 0, b <= 0, ab <= 0]):
+    if a <= 0 or b <= 0 or ab <= 0:
         raise ValueError("Source counts must be greater than zero")
 
     X = a * b - bg * ab
     Y = a * b * (ab + bg) - bg * ab * (a + b)
-    Z = Y * (a + b - ab - bg) / pow(X, 2)
+    Z = Y * (a + b - ab - bg) / (X * X)
     tau = X * (1 - sqrt(1 - Z)) / Y
 
     lost_counts = a + b - ab
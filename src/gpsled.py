@@ -12,9 +12,15 @@ import subprocess
 from argparse import ArgumentParser, Namespace
 from json import JSONDecodeError
 from json import dumps as jdumps
-from json import loads as jloads
+from re import compile as re_compile
 from re import match as re_match
 from time import sleep
+from typing import Iterator
+
+try:
+    from orjson import loads as jloads
+except ImportError:
+    from json import loads as jloads
 
 _example_systemd_unit = """
 [Unit]
@@ -31,6 +37,15 @@ Restart=on-failure
 WantedBy=multi-user.target
 """
 
+# ledtrig-pattern takes a list of "brightness duration_ms" pairs
+_PATTERN_3D_FIX = b"1 100 1 100\n"  # solid
+_PATTERN_2D_FIX = b"0 250 1 250\n"  # blink
+_PATTERN_NO_FIX = b"0 495 1 5\n"  # blip
+_PATTERN_ERROR = b"0 100\n"  # off
+
+_TPV_FIELDS = ("time", "mode", "lat", "lon", "alt", "speed", "track")
+_is_tpv = re_compile(rb'"class"\s*:\s*"TPV"').search
+
 
 def configure_led(args: Namespace, enable: bool = True):
     subprocess.run(["modprobe", "ledtrig-pattern"], check=True)
@@ -38,11 +53,11 @@ def configure_led(args: Namespace, enable: bool = True):
         print("pattern" if enable else "none", file=ofd)
 
     if enable is False:
-        with open(args.led_path.replace("/trigger", "/brightness"), "w") as ofd:
+        with open(args.led_brightness_path, "w") as ofd:
             print("0", file=ofd)
     else:
-        with open(args.led_path.replace("/trigger", "/pattern"), "w") as ofd:
-            print("0 495 1 5", file=ofd)
+        with open(args.led_pattern_path, "wb") as ofd:
+            ofd.write(_PATTERN_NO_FIX)
 
 
 def get_args() -> Namespace:
@@ -59,10 +74,9 @@ def get_args() -> Namespace:
             s = s[0]
         if s == "/dev/null":
             return s
-        if s.startswith("/sys/class/leds/") and s.endswith("/trigger"):
-            return s
-        else:
-            return _led(f"/sys/class/leds/{s}/trigger")
+        if not (s.startswith("/sys/class/leds/") and s.endswith("/trigger")):
+            s = f"/sys/class/leds/{s}/trigger"
+        return s
 
     ap = ArgumentParser()
     ap.add_argument(
@@ -89,12 +103,29 @@ def get_args() -> Namespace:
 
     args = ap.parse_args()
     args.led_path = args.led_path[0]
+    # the other attributes of the LED live beside its trigger
+    args.led_pattern_path = args.led_path.replace("/trigger", "/pattern")
+    args.led_brightness_path = args.led_path.replace("/trigger", "/brightness")
 
     if args.gpsd is None:
         args.gpsd = {"host": "localhost", "port": "2947", "dev": ""}
     return args
 
 
+def _read_lines(s: socket.socket, bufsize: int = 4096) -> Iterator[bytes]:
+    "Split the gpsd stream into lines, ending with an empty line when the connection is closed"
+    buf = b""
+    while True:
+        chunk = s.recv(bufsize)
+        if not chunk:
+            yield b""
+            return
+        *lines, buf = (buf + chunk).split(b"\n")
+        for line in lines:
+            if line:
+                yield line
+
+
 def gps_worker(args: Namespace) -> None:
     "Feed position fixes from a GPSD instance into the logs"
     srv = (args.gpsd["host"], 2947 if args.gpsd["port"] is None else args.gpsd["port"])
@@ -105,42 +136,53 @@ def gps_worker(args: Namespace) -> None:
     watch_args = {"enable": True, "json": True}
     if args.gpsd["dev"]:
         watch_args["device"] = args.gpsd["dev"]
-    watchstr = "?WATCH=" + jdumps(watch_args)
+    watchstr = ("?WATCH=" + jdumps(watch_args) + "\n").encode()
 
     last_state = None
-    with open(args.led_path.replace("/trigger", "/pattern"), "wt") as ofd:
+    # unbuffered, so each pattern goes straight to sysfs in a single write
+    with open(args.led_pattern_path, "wb", buffering=0) as ofd:
         while True:
             try:
                 with socket.create_connection(srv, 3) as s:
-                    gpsfd = s.makefile("rw")
-
-                    print(watchstr, file=gpsfd, flush=True)
+                    s.sendall(watchstr)
                     dedup = None
-                    while True:
-                        line = gpsfd.readline().strip()
+                    for line in _read_lines(s):
+                        # SKY and friends can be skipped without parsing them.
+                        # An empty line means the connection closed, and fails to parse below.
+                        if line and not _is_tpv(line):
+                            continue
                         try:
                             x = jloads(line)
                             if x["class"] != "TPV":
                                 continue
-                            if x["time"] == dedup:
+                            t = x.get("time")  # absent until there is a fix
+                            if t is not None and t == dedup:
                                 continue
-                            tpv = {f: x.get(f, None) for f in ["time", "mode", "lat", "lon", "alt", "speed", "track"]}
-
-                            if tpv["mode"] != last_state:
-                                if tpv["mode"] == 3:
-                                    print("1 100 1 100", flush=True, file=ofd)
-                                    tpv["led"] = "on"
-                                elif tpv["mode"] == 2:
-                                    print("0 250 1 250", flush=True, file=ofd)
-                                    tpv["led"] = "blink"
+                            dedup = t
+
+                            # only touch the LED when the fix changes, not on every report
+                            mode = x.get("mode")
+                            led = None
+                            if mode != last_state:
+                                if mode == 3:
+                                    ofd.write(_PATTERN_3D_FIX)
+                                    led = "on"
+                                elif mode == 2:
+                                    ofd.write(_PATTERN_2D_FIX)
+                                    led = "blink"
                                 else:
-                                    print("0 495 1 5", flush=True, file=ofd)
-                                    tpv["led"] = "blip"
+                                    ofd.write(_PATTERN_NO_FIX)
+                                    led = "blip"
+                                last_state = mode
 
                             if args.verbose:
+                                tpv = {f: x.get(f) for f in _TPV_FIELDS}
+                                if led:
+                                    tpv["led"] = led
                                 print(tpv)
                         except (KeyError, JSONDecodeError):  # skip bad messages, no fix, etc.
-                            print("0 100", flush=True, file=ofd)
+                            ofd.write(_PATTERN_ERROR)
+                            last_state = None  # restore the fix pattern after reconnecting
                             break
                     # End of read loop
             except (socket.error, TimeoutError) as e:
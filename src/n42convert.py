@@ -6,12 +6,92 @@
 
 import os
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
 from io import TextIOWrapper
-from typing import Any, Dict, List, Optional
-from uuid import UUID
+from textwrap import dedent
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+from uuid import UUID, uuid4
+
+import numpy as np
 
 from rcfiles import RcN42, RcSpectrum
 
+__version__ = "0.1.2"
+
+# These never change, so they're dedented once at import rather than on every call.
+_RAD_DETECTOR_INFORMATION = dedent("""
+    <RadDetectorInformation id="radiacode-csi-sipm">
+        <RadDetectorCategoryCode>Gamma</RadDetectorCategoryCode>
+        <RadDetectorKindCode>CsI</RadDetectorKindCode>
+        <RadDetectorDescription>CsI:Tl scintillator, coupled to SiPM</RadDetectorDescription>
+        <RadDetectorLengthValue units="mm">10</RadDetectorLengthValue>
+        <RadDetectorWidthValue units="mm">10</RadDetectorWidthValue>
+        <RadDetectorDepthValue units="mm">10</RadDetectorDepthValue>
+        <RadDetectorVolumeValue units="cc">1</RadDetectorVolumeValue>
+    </RadDetectorInformation>
+    """).strip()
+
+_N42_HEADER = dedent("""
+    <?xml version="1.0"?>
+    <?xml-model href="http://physics.nist.gov/N42/2011/schematron/n42.sch" type="application/xml" schematypens="http://purl.oclc.org/dsdl/schematron"?>
+    <RadInstrumentData xmlns="http://physics.nist.gov/N42/2011/N42"
+        xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+        xsi:schemaLocation="http://physics.nist.gov/N42/2011/N42 http://physics.nist.gov/N42/2011/n42.xsd"
+        n42DocUUID="{0}">
+    <RadInstrumentDataCreatorName>https://github.com/ckuethe/radiacode-tools</RadInstrumentDataCreatorName>
+    """).strip()
+_N42_FOOTER = "</RadInstrumentData>"
+
+
+def squareformat(a: List[int], columns: int = 16) -> str:
+    "Format a list of integers into rows of fixed width columns, eg. to make N42 ChannelData readable"
+    if columns < 1:
+        raise ValueError("columns must be positive")
+
+    a = np.asarray(a, dtype=np.int64)
+    nfull = len(a) - len(a) % columns
+    row_fmt = " ".join(["{:5d}"] * columns)
+    rv = "\n".join([row_fmt.format(*row) for row in a[:nfull].reshape(-1, columns).tolist()])
+    if nfull < len(a):
+        # the last row is short, and gets terminated so that it is obviously incomplete
+        rv += ("\n" if rv else "") + " ".join([f"{x:5d}" for x in a[nfull:].tolist()]) + "\n"
+    return rv
+
+
+def make_detector_info() -> str:
+    "Create the N42 RadDetectorInformation element"
+    return _RAD_DETECTOR_INFORMATION
+
+
+def iter_output(
+    *,
+    detector_info: str,
+    instrument_info: str,
+    fg_cal: str,
+    fg_spectrum: str,
+    bg_cal: str = "",
+    bg_spectrum: str = "",
+    uuid: Optional[UUID] = None,
+) -> Iterator[str]:
+    "Generate the lines of an N42 document from already formatted elements"
+    if uuid is None:
+        uuid = uuid4()
+    yield _N42_HEADER.format(uuid)
+    yield from (instrument_info, detector_info, fg_cal, bg_cal, fg_spectrum, bg_spectrum)
+    yield _N42_FOOTER
+
+
+def format_output(**kwargs) -> str:
+    "Assemble an N42 document from already formatted elements; see iter_output() for the arguments"
+    return "\n".join(iter_output(**kwargs))
+
+
+def write_output(ofd: TextIO, **kwargs) -> None:
+    "Write an N42 document piece by piece, rather than assembling the whole thing first"
+    for line in iter_output(**kwargs):
+        ofd.write(line)
+        ofd.write("\n")
+
 
 def get_args() -> Namespace:
     ap = ArgumentParser()
@@ -51,6 +131,14 @@ def get_args() -> Namespace:
         action="store_true",
         help="if given, treat the input path as a directory to process recursively with autogenerated output names",
     )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        default=os.cpu_count() or 1,
+        type=int,
+        metavar="N",
+        help="Number of files to convert in parallel in recursive mode. Default: %(default)s",
+    )
     ap.add_argument(
         "--overwrite",
         default=False,
@@ -73,7 +161,10 @@ def process_single_file(fg_file=None, bg_file=None, out_file=None, uuid=None, ov
         return  # shortcut for recursive mode
 
     fg_spec = RcSpectrum(fg_file)
-    bg_spec = RcSpectrum(bg_file)
+    if bg_file and os.path.realpath(bg_file) == os.path.realpath(fg_file):
+        bg_spec = fg_spec  # no need to parse the same file twice
+    else:
+        bg_spec = RcSpectrum(bg_file)
     n42 = RcN42()
     n42.spectrum_data.fg_spectrum = fg_spec.fg_spectrum
     if bg_spec.bg_spectrum:
@@ -96,15 +187,29 @@ def process_single_file(fg_file=None, bg_file=None, out_file=None, uuid=None, ov
     n42.write_file(out_file)
 
 
+def _convert_recursive_file(fg_file: str) -> None:
+    "Convert one file found in recursive mode, skipping it if it has already been converted"
+    process_single_file(fg_file=fg_file, out_file=f"{fg_file}.n42")
+
+
 def main() -> None:
     args = get_args()
 
     if args.recursive:
+        workqueue = []
         for cur_dir, _, files in os.walk(args.input):
             for fn in files:
                 if fn.endswith(".xml"):
-                    src_file = os.path.join(cur_dir, fn)
-                    process_single_file(fg_file=src_file, out_file=f"{src_file}.n42")
+                    workqueue.append(os.path.join(cur_dir, fn))
+
+        # Files are independent, and each one is written to <input>.n42
+        if args.jobs > 1 and len(workqueue) > 1:
+            chunksize = max(1, len(workqueue) // (4 * args.jobs))
+            with ProcessPoolExecutor(max_workers=min(args.jobs, len(workqueue))) as pool:
+                list(pool.map(_convert_recursive_file, workqueue, chunksize=chunksize))
+        else:
+            for src_file in workqueue:
+                _convert_recursive_file(src_file)
     else:
         process_single_file(
             fg_file=args.input,
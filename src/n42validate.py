@@ -5,11 +5,20 @@
 # SPDX-License-Identifier: MIT
 
 import os
+import pickle
+import sys
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formatdate
+from functools import lru_cache
+from itertools import chain
+from stat import S_IWGRP, S_IWOTH
 from tempfile import mkstemp
+from typing import Iterable, List, Tuple
 
 import defusedxml.ElementTree as ET
 import requests
+import xmlschema
 from xmlschema import XMLSchema
 
 # Seems unlikely that this will change anytime soon, and if it does
@@ -17,24 +26,80 @@ from xmlschema import XMLSchema
 SCHEMA_URL = "https://www.nist.gov/document/n42xsd"
 
 
-def fetch_or_load_xsd(schema_file="~/.cache/n42.xsd") -> XMLSchema:
+def fetch_or_load_xsd(schema_file="~/.cache/n42.xsd", schema_url=SCHEMA_URL, refresh=False) -> XMLSchema:
+    """
+    Load the schema, downloading it first if there is no local copy. If refresh is set,
+    ask the server whether the local copy is out of date; it is only rewritten if so.
+    """
     schema_file = os.path.expanduser(schema_file)
     schema_dir = os.path.dirname(schema_file)
     os.makedirs(schema_dir, exist_ok=True)
-    if not os.path.exists(schema_file) or 0 == os.path.getsize(schema_file):
-        resp = requests.get(SCHEMA_URL, timeout=10)
-        if resp.ok:
+    have_schema = os.path.exists(schema_file) and os.path.getsize(schema_file) > 0
+    if refresh or not have_schema:
+        headers = {}
+        if have_schema:
+            headers["If-Modified-Since"] = formatdate(os.path.getmtime(schema_file), usegmt=True)
+        try:
+            resp = requests.get(schema_url, headers=headers, timeout=10)
+        except requests.RequestException as e:
+            if not have_schema:
+                raise
+            print(f"Unable to refresh schema, using cached copy: {e}", file=sys.stderr)
+            return load_schema(schema_file, os.path.getmtime(schema_file))
+
+        if resp.status_code == 304:
+            pass  # local copy is current, and so is its pickle
+        elif resp.ok:
             tfd, tfn = mkstemp(prefix="schema_", dir=schema_dir)
             print(tfn)
             os.close(tfd)
             # file deepcode ignore PT: CLI tool intentionally opening the files the user asked for
             with open(tfn, "w") as ofd:
                 ofd.write(resp.text)
-            os.rename(tfn, schema_file)
-        else:
+            os.replace(tfn, schema_file)
+        elif not have_schema:
             raise RuntimeError("Unable to fetch schema")
+        else:
+            print(f"Unable to refresh schema, using cached copy: HTTP {resp.status_code}", file=sys.stderr)
+
+    return load_schema(schema_file, os.path.getmtime(schema_file))
+
+
+@lru_cache(maxsize=4)
+def load_schema(schema_file: str, mtime: float) -> XMLSchema:
+    """
+    Building the schema takes longer than validating most files, so the compiled schema
+    is pickled alongside the xsd. The pickle is only used if it was made from this exact
+    version of the xsd, by this version of xmlschema, and is owned by and only writable by the
+    current user. mtime is part of the cache key so that an updated xsd is picked up by long
+    running processes.
+    """
+    pickle_file = schema_file + ".pickle"
+    cache_key = (xmlschema.__version__, mtime)
+    try:
+        with open(pickle_file, "rb") as ifd:
+            # unpickling can run arbitrary code, so only trust a file that nobody else could have written
+            st = os.fstat(ifd.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & (S_IWGRP | S_IWOTH):
+                raise PermissionError(f"not loading {pickle_file}, it is writable by others")
+            key, schema = pickle.load(ifd)
+        if key == cache_key:
+            return schema
+    except Exception:
+        pass  # missing, stale, or corrupt; rebuild it.
 
-    return XMLSchema(schema_file)
+    schema = XMLSchema(schema_file)
+    tfn = None
+    try:
+        tfd, tfn = mkstemp(prefix="schema_", dir=os.path.dirname(pickle_file))
+        with os.fdopen(tfd, "wb") as ofd:
+            pickle.dump((cache_key, schema), ofd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tfn, pickle_file)
+    except Exception:
+        # can't write the cache, but the schema is still perfectly usable
+        if tfn and os.path.exists(tfn):
+            os.unlink(tfn)
+    return schema
 
 
 def get_args() -> Namespace:
@@ -76,7 +141,28 @@ def get_args() -> Namespace:
         metavar="XSD",
         help="Default: %(default)s",
     )
-
+    ap.add_argument(
+        "-u",
+        "--schema-url",
+        default=SCHEMA_URL,
+        type=str,
+        metavar="URL",
+        help="Default: %(default)s",
+    )
+    ap.add_argument(
+        "--refresh-schema",
+        default=False,
+        action="store_true",
+        help="check whether the cached schema is out of date, and update it if so",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        default=os.cpu_count() or 1,
+        type=int,
+        metavar="N",
+        help="Number of files to validate in parallel. Default: %(default)s",
+    )
     ap.add_argument(
         "-x",
         "--extension",
@@ -96,10 +182,51 @@ def get_args() -> Namespace:
     return ap.parse_args()
 
 
+def validate_file(schema_file: str, filename: str, details: bool = True) -> Tuple[bool, str]:
+    """
+    Check a single file against the schema, returning whether it is valid, and if not
+    (and details were requested), why not.
+
+    This is called from worker processes, which find the schema in their own cache (or
+    the pickle) rather than having it serialized for every file.
+    """
+    schema = load_schema(schema_file, os.path.getmtime(schema_file))
+    xml_doc = ET.parse(filename)
+    # the first error is what validate() would raise, so invalid files only need one pass
+    error = next(schema.iter_errors(xml_doc), None)
+    if error is None:
+        return True, ""
+    return False, str(error) if details else ""
+
+
+def validate_files(schema_file: str, filenames: List[str], details: bool = True) -> List[Tuple[bool, str]]:
+    "Check a batch of files, so that a worker process handles several files per round trip"
+    return [validate_file(schema_file, f, details) for f in filenames]
+
+
+def print_results(args: Namespace, filenames: List[str], results: Iterable[Tuple[bool, str]]) -> None:
+    "Report the validation results for each file, as selected by the command line options"
+    for f, (valid, reason) in zip(filenames, results):
+        if valid:
+            if args.verbose or args.valid_only:
+                print(f"[VALID] {f}")
+        else:
+            if args.valid_only:
+                continue
+            print(f"[ERROR] {f}")
+            if args.quiet:
+                continue
+            if reason:
+                print(reason)
+            print("-" * 75)
+
+
 def main() -> None:
     args = get_args()
 
-    schema = fetch_or_load_xsd(schema_file=args.schema_file)
+    schema_file = os.path.expanduser(args.schema_file)
+    # download and cache before any workers need it
+    fetch_or_load_xsd(schema_file=schema_file, schema_url=args.schema_url, refresh=args.refresh_schema)
 
     workqueue = []
     if args.recursive:
@@ -110,22 +237,21 @@ def main() -> None:
     else:
         workqueue = args.files
 
-    for f in workqueue:
-        xml_doc = ET.parse(f)
-        if schema.is_valid(xml_doc):
-            if args.verbose or args.valid_only:
-                print(f"[VALID] {f}")
-        else:
-            if args.valid_only:
-                continue
-            print(f"[ERROR] {f}")
-            if args.quiet:
-                continue
+    details = not (args.quiet or args.valid_only)
+    chunksize = max(1, len(workqueue) // (4 * max(1, args.jobs)))
+    chunks = [workqueue[i : i + chunksize] for i in range(0, len(workqueue), chunksize)]
+    # Each worker has to import xmlschema and load the schema, which costs more than validating a few files
+    if args.jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(chunks))) as pool:
+            futures = [pool.submit(validate_files, schema_file, chunk, details) for chunk in chunks]
             try:
-                schema.validate(xml_doc)
-            except Exception as e:
-                print(e)
-            print("-" * 75)
+                print_results(args, workqueue, chain.from_iterable(f.result() for f in futures))
+            finally:
+                # if reporting stopped early, don't wait for the rest of the files to be validated
+                for f in futures:
+                    f.cancel()
+    else:
+        print_results(args, workqueue, (validate_file(schema_file, f, details) for f in workqueue))
 
 
 if __name__ == "__main__":
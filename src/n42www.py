@@ -6,25 +6,28 @@
 
 import os
 from argparse import ArgumentParser, Namespace
-from io import BytesIO
+from functools import lru_cache
 from logging import DEBUG, INFO, WARNING, Logger, basicConfig, getLogger
-from re import sub as resub
+from re import compile as re_compile
 
-from flask import Flask, abort, request, send_file
+from flask import Flask, Response, abort, request
 
 from rcfiles import RcN42, RcSpectrum
 
 appname = "N42Server"
 logger: Logger = getLogger(appname)
 n42srv = Flask(appname)
+# Also applies when n42srv is served by an external WSGI server rather than main()
+n42srv.config["MAX_CONTENT_LENGTH"] = 128 * 1024
 
 
 input_name = "file-input"
+# runs of unsafe characters and underscores both collapse to a single underscore
+_unsafe_chars = re_compile(r"[^a-zA-Z0-9.-]+")
 
 
-@n42srv.route("/")
-def handle_index():
-    page = f"""
+# The index page never changes, so it is rendered and encoded once at import.
+_INDEX_HTML = f"""
     <h2>Radiacode to N42 Converter</h2>
 
 
@@ -33,9 +36,25 @@ def handle_index():
         <input id="{input_name}" name="{input_name}" type="file" />
         <button id="upload-button">Upload</button>
     </form>
+    """.encode()
+
+
+@lru_cache(maxsize=128)
+def _convert(data: bytes) -> bytes:
+    """
+    Convert an uploaded spectrum to N42, ready to send. The output only depends on the file
+    contents (even the UUID is derived from them) so repeated uploads are served from the cache.
     """
+    sp = RcSpectrum()
+    n42 = RcN42()
+    sp.load_str(data)
+    n42.from_rcspectrum(sp)
+    return n42.generate_xml().encode()
 
-    return page
+
+@n42srv.route("/")
+def handle_index():
+    return Response(_INDEX_HTML, mimetype="text/html")
 
 
 @n42srv.route("/convert", methods=["POST"])
@@ -46,27 +65,21 @@ def handle_convert():
 
     upload = request.files[input_name]
     try:
-        sp = RcSpectrum()
-        n42 = RcN42()
-        sp.load_str(upload.stream.read())
-        n42.from_rcspectrum(sp)
-        converted = n42.generate_xml()
-
+        converted = _convert(upload.stream.read())
     except KeyboardInterrupt:
         raise
     except Exception:
         abort(400)
 
     filename = os.path.basename(upload.filename).removesuffix(".xml")
-    filename = resub("[^a-zA-Z0-9_.-]", "_", filename)
-    filename = resub("_+", "_", filename) + ".n42"
-
-    return send_file(
-        BytesIO(converted.encode()),
-        mimetype="application/octet-stream",
-        download_name=filename,
-        max_age=1,
-    )
+    filename = _unsafe_chars.sub("_", filename) + ".n42"
+
+    # The document is already encoded, so it is sent as is, with a Content-Length
+    resp = Response(converted, mimetype="application/octet-stream")
+    resp.headers.set("Content-Disposition", "attachment", filename=filename)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 1
+    return resp
 
 
 def get_args() -> Namespace:
@@ -91,7 +104,7 @@ def get_args() -> Namespace:
         "--max-size",
         type=int,
         metavar="NUM",
-        default=128 * 1024,
+        default=n42srv.config["MAX_CONTENT_LENGTH"],
         help="Maximum upload file size in bytes [%(default)s]",
     )
     ap.add_argument(
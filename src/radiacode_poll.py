@@ -9,21 +9,30 @@ import os
 import sys
 import warnings
 from argparse import ArgumentParser, Namespace
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+from re import fullmatch as re_fullmatch
+from signal import SIGINT, signal
 from tempfile import mkstemp
 from textwrap import dedent
-from time import sleep
-from typing import Dict
+from threading import Event
+from time import monotonic
+from typing import Dict, Optional
 from urllib.parse import quote_plus
 from uuid import uuid4
 from zlib import compress as deflate
 
+import numpy as np
 import radiacode
-from dateutil.parser import parse as dp
-from tqdm.auto import tqdm
 
 import n42convert
-from rcutils import get_device_id, get_dose_from_spectrum, probe_radiacode_devices
+from rcutils import (
+    get_device_id,
+    get_dose_from_counts,
+    get_dose_from_spectrum,
+    get_energy_axis,
+    probe_radiacode_devices,
+    stringify,
+)
 
 
 def get_args() -> Namespace:
@@ -33,6 +42,17 @@ def get_args() -> Namespace:
             return f
         raise ValueError("value must be greater than 0")
 
+    def duration(s) -> int:
+        "Convert hh:mm[:ss], a number of seconds, or a string like 1h30m into seconds"
+        m = re_fullmatch(r"(\d+):(\d+)(?::(\d+))?", s) or re_fullmatch(r"(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?", s)
+        if m is None:
+            raise ValueError("not a duration")
+        hours, minutes, seconds = [int(x) if x else 0 for x in m.groups()]
+        rv = 3600 * hours + 60 * minutes + seconds
+        if rv > 0:
+            return rv
+        raise ValueError("duration must be greater than 0")
+
     ap = ArgumentParser(description="Poll a RadiaCode PSRD and produce an N42 file")
     ap.add_argument(
         "-b",
@@ -57,9 +77,9 @@ def get_args() -> Namespace:
     )
     mx.add_argument(
         "--accumulate-time",
-        type=str,
+        type=duration,
         metavar="TIME",
-        help="Measure for a given amount of time (timedelta)",
+        help="Measure for a given amount of time (hh:mm[:ss], or eg. 90s, 1h30m)",
     )
     mx.add_argument(
         "--accumulate-dose",
@@ -115,20 +135,19 @@ def get_args() -> Namespace:
     return rv
 
 
-def make_instrument_info(dev_id: Dict[str, str]):
-    "Create the N42 RadInstrumentInformation element"
-    radiacode_ver = importlib.metadata.version("radiacode")
+# reading the package metadata walks sys.path, so it's only done once
+_RADIACODE_VERSION = getattr(radiacode, "__version__", None) or importlib.metadata.version("radiacode")
 
-    rv = f"""
-    <RadInstrumentInformation id="rii-{dev_id["hw_num"]}">
+_INSTRUMENT_INFO_TEMPLATE = dedent("""
+    <RadInstrumentInformation id="rii-{hw_num}">
         <RadInstrumentManufacturerName>Radiacode</RadInstrumentManufacturerName>
-        <RadInstrumentIdentifier>{dev_id["sernum"]}</RadInstrumentIdentifier>
-        <RadInstrumentModelName>{dev_id["product"]}</RadInstrumentModelName>
+        <RadInstrumentIdentifier>{sernum}</RadInstrumentIdentifier>
+        <RadInstrumentModelName>{product}</RadInstrumentModelName>
         <RadInstrumentClassCode>Spectroscopic Personal Radiation Detector</RadInstrumentClassCode>
-      
+
         <RadInstrumentVersion>
             <RadInstrumentComponentName>Firmware</RadInstrumentComponentName>
-            <RadInstrumentComponentVersion>{dev_id["fw_ver"]}</RadInstrumentComponentVersion>
+            <RadInstrumentComponentVersion>{fw_ver}</RadInstrumentComponentVersion>
         </RadInstrumentVersion>
         <RadInstrumentVersion>
             <RadInstrumentComponentName>python-radiacode</RadInstrumentComponentName>
@@ -136,20 +155,54 @@ def make_instrument_info(dev_id: Dict[str, str]):
         </RadInstrumentVersion>
         <RadInstrumentVersion>
             <RadInstrumentComponentName>Converter</RadInstrumentComponentName>
-            <RadInstrumentComponentVersion>{n42convert.__version__}</RadInstrumentComponentVersion>
+            <RadInstrumentComponentVersion>{converter_ver}</RadInstrumentComponentVersion>
         </RadInstrumentVersion>
     </RadInstrumentInformation>
-    """
-    return dedent(rv).strip()
+    """).strip()
+
+_CALIBRATION_TEMPLATE = dedent("""
+    <EnergyCalibration id="ec-{hw_num}-{tag}">
+        <CoefficientValues> {a0} {a1} {a2} </CoefficientValues>
+    </EnergyCalibration>
+    """).strip()
+
+_SPECTRUM_TEMPLATE = dedent("""
+    <RadMeasurement id="rm-{hw_num}-{tag}">
+        <MeasurementClassCode>{mc}</MeasurementClassCode>
+        <StartDateTime> {sdt} </StartDateTime>
+        <RealTimeDuration> PT{md}S </RealTimeDuration>
+        <Spectrum id="sp-{hw_num}-{tag}" radDetectorInformationReference="radiacode-csi-sipm" energyCalibrationReference="ec-{hw_num}-{tag}">
+            <LiveTimeDuration> PT{md}S </LiveTimeDuration>
+            <ChannelData compressionCode="None"> {counts} </ChannelData>
+        </Spectrum>
+    </RadMeasurement>
+    """).strip()
+
 
+def make_instrument_info(dev_id: Dict[str, str]):
+    "Create the N42 RadInstrumentInformation element"
+    return _INSTRUMENT_INFO_TEMPLATE.format(
+        hw_num=dev_id["hw_num"],
+        sernum=dev_id["sernum"],
+        product=dev_id["product"],
+        fw_ver=dev_id["fw_ver"],
+        radiacode_ver=_RADIACODE_VERSION,
+        converter_ver=n42convert.__version__,
+    )
+
+
+def format_spectrum(hw_num: str, res: radiacode.Spectrum, bg: bool = False, now: Optional[datetime] = None):
+    """
+    format a radiacode.Spectrum to be printed by n42convert
 
-def format_spectrum(hw_num: str, res: radiacode.Spectrum, bg: bool = False):
-    "format a radiacode.Spectrum to be printed by n42convert"
-    md = res.duration.total_seconds()
-    count_str = " ".join([str(i) for i in res.counts])
+    now: when the spectrum was read from the device, so that spectra read together get consistent start times
+    """
+    md = f"{res.duration.total_seconds():.3f}"  # fixed precision keeps float noise out of the output
 
-    now = datetime.utcnow()
-    sdt = (now - res.duration).strftime("%Y-%m-%dT%H:%M:%S")
+    if now is None:
+        now = datetime.now(timezone.utc)
+    # N42 times here are naive UTC
+    sdt = (now - res.duration).replace(tzinfo=None).isoformat(timespec="seconds")
     if bg:
         mc = "Background"
         tag = "bg"
@@ -159,25 +212,9 @@ def format_spectrum(hw_num: str, res: radiacode.Spectrum, bg: bool = False):
 
     # This calibration is shared between the foreground and background measurements since
     # they come from the same instrument, and in this case the same observing session.
-
-    cal_str = f"""
-        <EnergyCalibration id="ec-{hw_num}-{tag}">
-            <CoefficientValues> {res.a0} {res.a1} {res.a2} </CoefficientValues>
-        </EnergyCalibration>
-        """
-
-    spec_str = f"""
-        <RadMeasurement id="rm-{hw_num}-{tag}">
-            <MeasurementClassCode>{mc}</MeasurementClassCode>
-            <StartDateTime> {sdt} </StartDateTime>
-            <RealTimeDuration> PT{md}S </RealTimeDuration>
-            <Spectrum id="sp-{hw_num}-{tag}" radDetectorInformationReference="radiacode-csi-sipm" energyCalibrationReference="ec-{hw_num}-{tag}"> 
-                <LiveTimeDuration> PT{md}S </LiveTimeDuration>
-                <ChannelData compressionCode="None"> {count_str} </ChannelData> 
-            </Spectrum>
-        </RadMeasurement>
-        """
-    return dedent(cal_str), dedent(spec_str)
+    cal_str = _CALIBRATION_TEMPLATE.format(hw_num=hw_num, tag=tag, a0=res.a0, a1=res.a1, a2=res.a2)
+    spec_str = _SPECTRUM_TEMPLATE.format(hw_num=hw_num, tag=tag, mc=mc, sdt=sdt, md=md, counts=stringify(res.counts))
+    return cal_str, spec_str
 
 
 def main() -> None:
@@ -194,49 +231,74 @@ def main() -> None:
         dev.dose_reset()
 
     dev_id = get_device_id(dev)
+    # these are the same whichever kind of output is produced
+    detector_info = n42convert.make_detector_info()
+    instrument_info = make_instrument_info(dev_id)
     measurement = dev.spectrum()  # Always grab a spectrum to start
-    obs_start = datetime.utcnow()
+    obs_start = datetime.now(timezone.utc)
+    # reported at the end, and the starting point when accumulating a set dose
+    initial_dose = get_dose_from_spectrum(measurement.counts, measurement.a0, measurement.a1, measurement.a2)
+    # n42_doc collects the elements of the output document, which is written piece by piece at the end
     if args.a:  # are we accumulating measurements over time?
+        # only needed here, so don't make single captures pay for importing it
+        from tqdm.auto import tqdm
+
         # suppress tqdm warnings when we exceed the expected maximum
         warnings.filterwarnings("ignore", module="tqdm")
-        if args.accumulate:  # yep, until ^C
-            with tqdm(desc="Integration time", unit="s", total=float("inf")) as t:
-                try:
-                    while True:
-                        sleep(1)
-                        t.update()
-                except KeyboardInterrupt:
-                    t.close()
-        elif args.accumulate_time:  # yep, for a fixed duration
-            tx = dp(args.accumulate_time).time()
-            tx = int(timedelta(hours=tx.hour, minutes=tx.minute, seconds=tx.second).total_seconds())
-
-            with tqdm(desc="Integration time", unit="s", total=tx) as t:
-                try:
-                    for _ in range(tx):
-                        sleep(1)
+        # Only redraw the progress bar about once a second even when updated more often, and not at all
+        # if stderr isn't a terminal.
+        tqdm_opts = {"mininterval": 1.0, "maxinterval": 5.0, "disable": None}
+        # ^C ends the accumulation promptly, rather than raising KeyboardInterrupt wherever we happen to be
+        stop = Event()
+        prev_sigint = signal(SIGINT, lambda signum, frame: stop.set())
+        try:
+            if args.accumulate:  # yep, until ^C
+                with tqdm(desc="Integration time", unit="s", total=float("inf"), **tqdm_opts) as t:
+                    while not stop.wait(1):
                         t.update()
-                except KeyboardInterrupt:
-                    t.close()
-        elif args.accumulate_dose:  # yep, until a set dose is reached
-            e0 = get_dose_from_spectrum(measurement.counts, measurement.a0, measurement.a1, measurement.a2)
-            with tqdm(
-                desc=f"Target Dose ({args.accumulate_dose:.3f}uSv)",
-                unit="uSv",
-                total=round(args.accumulate_dose, 3),
-            ) as t:
-                try:
-                    waiting = True
-                    while waiting:
-                        sleep(1)
-                        s = dev.spectrum()
-                        recv_dose = get_dose_from_spectrum(s.counts, s.a0, s.a1, s.a2) - e0
-                        t.n = round(recv_dose, 3)
-                        t.display()
+            elif args.accumulate_time:  # yep, for a fixed duration
+                tx = args.accumulate_time
+
+                # Sleep towards a deadline rather than counting 1s naps, which drift. The progress bar
+                # can't show more than about 100 steps, so there's no point waking up more often.
+                deadline = monotonic() + tx
+                step = max(1.0, tx / 100)
+                with tqdm(desc="Integration time", unit="s", total=tx, **tqdm_opts) as t:
+                    remaining = float(tx)
+                    while remaining > 0 and not stop.wait(min(step, remaining)):
+                        remaining = deadline - monotonic()
+                        elapsed = min(tx, round(tx - remaining))
+                        if elapsed != t.n:  # don't make tqdm redraw when nothing has changed
+                            t.update(elapsed - t.n)
+            elif args.accumulate_dose:  # yep, until a set dose is reached
+                # calibration doesn't change during a session, so each poll is just a dot product
+                energy_axis = get_energy_axis(len(measurement.counts), measurement.a0, measurement.a1, measurement.a2)
+                e0 = initial_dose
+                last_dose, last_poll = 0.0, monotonic()
+                interval = 1.0
+                with tqdm(
+                    desc=f"Target Dose ({args.accumulate_dose:.3f}uSv)",
+                    unit="uSv",
+                    total=round(args.accumulate_dose, 3),
+                    **tqdm_opts,
+                ) as t:
+                    while not stop.wait(interval):
+                        recv_dose = get_dose_from_counts(energy_axis, dev.spectrum().counts) - e0
+                        now = monotonic()
+                        if round(recv_dose, 3) != t.n:
+                            t.update(round(recv_dose, 3) - t.n)
                         if recv_dose >= args.accumulate_dose:
-                            waiting = False
-                except KeyboardInterrupt:
-                    t.close()
+                            break
+                        # Poll about ten times over the estimated time remaining, which leaves the device link
+                        # alone while the target is far off. The estimate uses the rate since the last poll so
+                        # that it follows a source being moved, and the wait is capped so that a change in rate
+                        # between polls can't overshoot the target by much.
+                        if recv_dose > last_dose:
+                            eta = (args.accumulate_dose - recv_dose) * (now - last_poll) / (recv_dose - last_dose)
+                            interval = min(10.0, max(1.0, eta / 10))
+                        last_dose, last_poll = recv_dose, now
+        finally:
+            signal(SIGINT, prev_sigint)
 
         # Cool, we've waited long enough, grab the end spectrum
         measurement1 = dev.spectrum()
@@ -244,7 +306,8 @@ def main() -> None:
         if args.bgsub:
             # Subtract initial measurement to get just the accumulated data
             dt = measurement1.duration - measurement.duration
-            dc = [x[1] - x[0] for x in zip(measurement.counts, measurement1.counts)]
+            # format_spectrum can consume the array directly, no need to convert it back to a list
+            dc = np.subtract(measurement1.counts, measurement.counts, dtype=np.int64)
             dm = radiacode.Spectrum(
                 duration=dt,
                 a0=measurement1.a0,
@@ -253,21 +316,20 @@ def main() -> None:
                 counts=dc,
             )
             diff_cal, diff_spec = format_spectrum(dev_id["hw_num"], dm)
-
-        if args.bgsub:
-            data = n42convert.format_output(
-                detector_info=n42convert.make_detector_info(),
-                instrument_info=make_instrument_info(dev_id),
+            n42_doc = dict(
+                detector_info=detector_info,
+                instrument_info=instrument_info,
                 fg_cal=diff_cal,
                 fg_spectrum=diff_spec,
                 uuid=uuid4(),
             )
         else:
-            cal, spec = format_spectrum(dev_id["hw_num"], measurement1)
-            bg_cal, bg_spec = format_spectrum(dev_id["hw_num"], measurement, bg=True)
-            data = n42convert.format_output(
-                detector_info=n42convert.make_detector_info(),
-                instrument_info=make_instrument_info(dev_id),
+            now = datetime.now(timezone.utc)
+            cal, spec = format_spectrum(dev_id["hw_num"], measurement1, now=now)
+            bg_cal, bg_spec = format_spectrum(dev_id["hw_num"], measurement, bg=True, now=now)
+            n42_doc = dict(
+                detector_info=detector_info,
+                instrument_info=instrument_info,
                 fg_cal=cal,
                 fg_spectrum=spec,
                 bg_cal=bg_cal,  # FIXME - reuse the foreground calibration
@@ -276,59 +338,69 @@ def main() -> None:
             )
     else:  # instantaneous capture
         cal, spec = format_spectrum(dev_id["hw_num"], measurement)
-        data = n42convert.format_output(
-            detector_info=n42convert.make_detector_info(),
-            instrument_info=make_instrument_info(dev_id),
+        n42_doc = dict(
+            detector_info=detector_info,
+            instrument_info=instrument_info,
             fg_cal=cal,
             fg_spectrum=spec,
             uuid=uuid4(),
         )
 
-    dose = get_dose_from_spectrum(measurement.counts, measurement.a0, measurement.a1, measurement.a2)
-    print(f"Total dose: {dose:.2f}uSv ({dev_id['sernum']})", file=sys.stderr)
+    print(f"Total dose: {initial_dose:.2f}uSv ({dev_id['sernum']})", file=sys.stderr)
     ofd = None
     if args.outfile:
-        tfd, tfn = mkstemp(dir=".")
-        os.close(tfd)
-
-    if args.url or args.qrcode:
-        import radqr
-
-        enc_opts = radqr.OPT_CSV_SPECTRUM
-        enc_opts, msg = radqr.make_qr_payload(
-            lr_times=[measurement.duration.total_seconds()] * 2,
-            spectrum=measurement.counts,
-            calibration=[measurement.a0, measurement.a1, measurement.a2],
-            detector_model=f"{dev_id['product']} {dev_id['sernum']}",
-            mclass="F",
-            timestamp=obs_start,
-            options=enc_opts,
-        )
-        qbody = quote_plus(radqr.b45_encode(deflate(msg)))
-        url = f"RADDATA://G0/{enc_opts:02X}00/{qbody}"
-        if args.qrcode:
-            import qrcode
+        # Keep the temporary file next to the output, so that it can be atomically renamed into place
+        out_dir = os.path.dirname(os.path.abspath(args.outfile))
+        tfd, tfn = mkstemp(dir=out_dir, prefix=".radiacode_poll-", suffix=".tmp")
+
+    try:
+        if args.url or args.qrcode:
+            import radqr
+
+            enc_opts = radqr.OPT_CSV_SPECTRUM
+            enc_opts, msg = radqr.make_qr_payload(
+                lr_times=[measurement.duration.total_seconds()] * 2,
+                spectrum=measurement.counts,
+                calibration=[measurement.a0, measurement.a1, measurement.a2],
+                detector_model=f"{dev_id['product']} {dev_id['sernum']}",
+                mclass="F",
+                timestamp=obs_start,
+                options=enc_opts,
+            )
+            qbody = quote_plus(radqr.b45_encode(deflate(msg)))
+            url = f"RADDATA://G0/{enc_opts:02X}00/{qbody}"
+            if args.qrcode:
+                import qrcode
+
+                qc = qrcode.QRCode()
+                qc.add_data(url)
+                if args.outfile:
+                    ofd = os.fdopen(tfd, "wb")
+                qc.make_image().save(ofd)
+            else:
+                if args.outfile:
+                    ofd = os.fdopen(tfd, "w")
+                print(url, file=ofd)
 
-            qc = qrcode.QRCode()
-            qc.add_data(url)
-            if args.outfile:
-                ofd = open(tfn, "wb")
-            qc.make_image().save(ofd)
         else:
             if args.outfile:
-                ofd = open(tfn, "w")
-            print(url, file=ofd)
+                ofd = os.fdopen(tfd, "w")
+            n42convert.write_output(ofd if ofd else sys.stdout, **n42_doc)
 
-    else:
         if args.outfile:
-            ofd = open(tfn, "w")
-        print(data, file=ofd)
-
-    if args.outfile:
-        if ofd:
-            ofd.close()
-        # file deepcode ignore PT: CLI tool intentionally opening the files the user asked for
-        os.rename(tfn, args.outfile)
+            if ofd:
+                ofd.close()
+            # file deepcode ignore PT: CLI tool intentionally opening the files the user asked for
+            os.replace(tfn, args.outfile)
+    except BaseException:
+        # don't leave a hidden, partly written temporary file behind, even on ^C
+        if args.outfile:
+            if ofd:
+                ofd.close()
+            else:
+                os.close(tfd)
+            os.unlink(tfn)
+        raise
 
 
 if __name__ == "__main__":
@@ -7,32 +7,32 @@
 import struct
 from typing import List, Union
 
+import numpy as np
+
 from rctypes import Number
 
 _B45C = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"  # defined in RFC9285
+_B45C_TABLE = np.frombuffer(_B45C.encode("ascii"), dtype=np.uint8)
 
 
-def b45_encode(s: Union[str, bytearray]) -> str:
+def b45_encode(s: Union[str, bytes, bytearray]) -> str:
     "Encode a string or bytearray into a base45 ASCII *string*"
-    rv = []
     if isinstance(s, str):
-        s = bytearray(s, "utf-8")
-    padded = False
-    for i in range(0, len(s), 2):
-        try:
-            intval = s[i] * 256 + s[i + 1]
-        except IndexError:
-            intval = s[i]
-            padded = True
-
-        r, x = divmod(intval, 45)
-        z, y = divmod(r, 45)
-
-        rv.extend([_B45C[c] for c in (x, y, z)])
-
-    if padded:
-        rv.pop(-1)
-    return "".join(rv)
+        s = s.encode("utf-8")
+    a = np.frombuffer(s, dtype=np.uint8)
+    npairs = len(a) // 2
+
+    # Each pair of bytes is a big-endian 16 bit value, written as three base45 digits, least significant first.
+    # Doing all the pairs at once keeps the arithmetic out of the interpreter, which matters for QR payloads.
+    pairs = a[: 2 * npairs].reshape(-1, 2).astype(np.uint32)
+    r, x = np.divmod(pairs[:, 0] * 256 + pairs[:, 1], 45)
+    z, y = np.divmod(r, 45)
+    rv = _B45C_TABLE[np.stack((x, y, z), axis=1)].tobytes().decode("ascii")
+
+    if len(a) % 2:  # a trailing odd byte only needs two digits
+        z, y = divmod(int(a[-1]), 45)
+        rv += _B45C[y] + _B45C[z]
+    return rv
 
 
 def b45_decode(s: str) -> bytes:
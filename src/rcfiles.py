@@ -16,15 +16,19 @@ from struct import pack as struct_pack
 from struct import unpack as struct_unpack
 from typing import Any, Dict, List, Optional
 from uuid import uuid4
+from xml.etree.ElementTree import Element
 
+import defusedxml.ElementTree as ET
+import numpy as np
 import xmltodict
 
 from rctypes import EnergyCalibration, SpectrogramPoint, SpectrumLayer, TrackPoint
-from rcutils import DateTime2FileTime, FileTime2DateTime
+from rcutils import DateTime2FileTime, FileTime2DateTime, stringify
 
 # there's enough datetime mangling that it's worth making a few helpers
 _datestr: str = "%Y-%m-%d %H:%M:%S"
 _datestr_T: str = _datestr.replace(" ", "T")
+_n42_ns: Dict[str, str] = {"n42": "http://physics.nist.gov/N42/2011/N42"}
 
 
 def _parse_datetime(ds: str, fmt: str = _datestr) -> datetime:
@@ -35,6 +39,19 @@ def _format_datetime(dt: datetime, fmt: str = _datestr) -> str:
     return dt.strftime(fmt)
 
 
+def _findtext(e: Element, path: str) -> Optional[str]:
+    "Like Element.findtext(), but empty or missing elements are None and whitespace is stripped"
+    rv = e.findtext(path)
+    if rv:
+        rv = rv.strip()
+    return rv if rv else None
+
+
+def _parse_counts(data: str) -> List[int]:
+    "Convert a string of whitespace separated counts into a list of ints, raising ValueError on a bad count"
+    return np.array(data.split(), dtype=np.int64).tolist()
+
+
 class RcTrack:
     "Radiacode Track (.rctrk) interface"
 
@@ -184,19 +201,19 @@ class RcSpectrum:
     def __repr__(self):
         return "Spectrum(" f"\n\tfg={self.fg_spectrum}" f"\n\tbg={self.bg_spectrum}" f'\n\tnote="{self.note}"\n)'
 
-    def _parse_spectrum(self, spectrum: Dict[str, Any]) -> SpectrumLayer:
-        """Given an spectrum dict, return useful items"""
-        coeffs = [float(f) for f in spectrum["EnergyCalibration"]["Coefficients"]["Coefficient"]]
-        polynomial_order = int(spectrum["EnergyCalibration"]["PolynomialOrder"])
+    def _parse_spectrum(self, spectrum: Element) -> SpectrumLayer:
+        """Given an spectrum element, return useful items"""
+        coeffs = [float(f.text) for f in spectrum.iterfind("EnergyCalibration/Coefficients/Coefficient")]
+        polynomial_order = int(spectrum.findtext("EnergyCalibration/PolynomialOrder"))
 
         rv = SpectrumLayer(
-            spectrum_name=spectrum["SpectrumName"],
+            spectrum_name=_findtext(spectrum, "SpectrumName"),
             device_model="",
-            serial_number=spectrum.get("SerialNumber", None),
+            serial_number=_findtext(spectrum, "SerialNumber"),
             calibration=EnergyCalibration(*coeffs),
-            duration=int(spectrum["MeasurementTime"]),
-            channels=int(spectrum["NumberOfChannels"]),
-            counts=[int(i) for i in spectrum["Spectrum"]["DataPoint"]],
+            duration=int(spectrum.findtext("MeasurementTime")),
+            channels=int(spectrum.findtext("NumberOfChannels")),
+            counts=_parse_counts(" ".join([i.text for i in spectrum.iterfind("Spectrum/DataPoint")])),
         )
 
         if len(rv.counts) != rv.channels:
@@ -211,34 +228,39 @@ class RcSpectrum:
         return rv
 
     def load_file(self, filename: str) -> None:
-        with open(filename) as ifd:
-            self.load_str(ifd.read())
+        self._load_tree(ET.parse(filename).getroot())
 
     def load_str(self, data: str) -> None:
-        sp = xmltodict.parse(data, dict_constructor=dict)["ResultDataFile"]["ResultDataList"]["ResultData"]
+        self._load_tree(ET.fromstring(data))
 
-        tmp = sp["EnergySpectrum"]  # explode if the spectrum is missing. No foreground = not useful
-        self.fg_spectrum = self._parse_spectrum(tmp)._replace(device_model=sp["DeviceConfigReference"]["Name"])
+    def _load_tree(self, root: Element) -> None:
+        "Pull the foreground and (optional) background layers out of a parsed spectrum file"
+        sp = root.find("ResultDataList/ResultData")
+        if root.tag != "ResultDataFile" or sp is None:
+            raise ValueError("This doesn't look like a valid spectrum - missing ResultData")
+
+        tmp = sp.find("EnergySpectrum")  # explode if the spectrum is missing. No foreground = not useful
+        self.fg_spectrum = self._parse_spectrum(tmp)._replace(device_model=_findtext(sp, "DeviceConfigReference/Name"))
 
         try:
-            tmp = sp.get("BackgroundEnergySpectrum")
+            tmp = sp.find("BackgroundEnergySpectrum")
             self.bg_spectrum = self._parse_spectrum(tmp)
         except (KeyError, AttributeError, TypeError):
             tmp = None
 
         # older versions of data files don't have start and end times
-        if tmp:
+        if tmp is not None:
             try:
-                a = [_parse_datetime(s, _datestr_T) for s in sp.get("StartTime", None)]
-                b = [_parse_datetime(s, _datestr_T) for s in sp.get("EndTime", None)]
+                a = [_parse_datetime(s.text, _datestr_T) for s in sp.iterfind("StartTime")]
+                b = [_parse_datetime(s.text, _datestr_T) for s in sp.iterfind("EndTime")]
                 self.fg_spectrum = self.fg_spectrum._replace(timestamp=a[0], duration=b[0] - a[0])
                 self.bg_spectrum = self.bg_spectrum._replace(timestamp=a[1], duration=b[1] - a[1])
-            except (KeyError, TypeError, AttributeError):
+            except (KeyError, TypeError, AttributeError, IndexError):
                 pass
         else:
             try:
-                a = _parse_datetime(sp.get("StartTime", None), _datestr_T)
-                b = _parse_datetime(sp.get("EndTime", None), _datestr_T)
+                a = _parse_datetime(sp.findtext("StartTime"), _datestr_T)
+                b = _parse_datetime(sp.findtext("EndTime"), _datestr_T)
                 d = b - a
                 self.fg_spectrum = self.fg_spectrum._replace(timestamp=a, duration=d)
             except (KeyError, TypeError, AttributeError):
@@ -530,6 +552,7 @@ class RcSpectrogram:
 
 class RcN42:
     "Minimal N42 implementation that can transcode to/from dual layer RadiaCode XML spectrum"
+
     rad_detector_information: Dict[str, Any] = {}
     rad_instrument_information: Dict[str, Any] = {}
     _rdi: str = "radiacode-scinitillator-sipm"
@@ -554,17 +577,18 @@ class RcN42:
             "RadInstrumentDataCreatorName": "https://github.com/ckuethe/radiacode-tools",
         }
 
-    def _spectrum_layer_from_rad_measurement(self, rm: Dict[str, Any], ecz: Dict[str, Any]) -> SpectrumLayer:
-        ec = EnergyCalibration(*[float(x) for x in ecz[rm["Spectrum"]["@energyCalibrationReference"]].split()])
-        counts = [int(x) for x in rm["Spectrum"]["ChannelData"]["#text"].split()]
+    def _spectrum_layer_from_rad_measurement(self, rm: Element, ecz: Dict[str, str]) -> SpectrumLayer:
+        spectrum = rm.find("n42:Spectrum", _n42_ns)
+        ec = EnergyCalibration(*[float(x) for x in ecz[spectrum.get("energyCalibrationReference")].split()])
+        counts = _parse_counts(spectrum.findtext("n42:ChannelData", "", _n42_ns))
 
         return SpectrumLayer(
-            spectrum_name=rm["Remark"].replace("Title: ", ""),
+            spectrum_name=rm.findtext("n42:Remark", "", _n42_ns).strip().replace("Title: ", ""),
             device_model=self.model,
             serial_number=self.serial_number,
             calibration=ec,
-            timestamp=_parse_datetime(rm["StartDateTime"], _datestr_T),
-            duration=timedelta(seconds=int(rm["RealTimeDuration"].strip("PTS"))),
+            timestamp=_parse_datetime(rm.findtext("n42:StartDateTime", "", _n42_ns).strip(), _datestr_T),
+            duration=timedelta(seconds=int(rm.findtext("n42:RealTimeDuration", "", _n42_ns).strip().strip("PTS"))),
             channels=len(counts),
             counts=counts,
             comment="",
@@ -592,7 +616,7 @@ class RcN42:
                 "LiveTimeDuration": duration,
                 "ChannelData": {
                     "@compressionCode": "None",
-                    "#text": " ".join([f"{i}" for i in sl.counts]),
+                    "#text": stringify(sl.counts),
                 },
             },
         }
@@ -645,8 +669,8 @@ class RcN42:
 
         Use this to read from the filesystem
         """
-        with open(filename, "rt") as ifd:
-            self.load_data(ifd.read())
+        with open(filename, "rb") as ifd:
+            self.load_data(ifd)
 
     def load_data(self, data) -> None:
         """
@@ -654,27 +678,24 @@ class RcN42:
 
         Use this function if you're passing in a string or file object.
         """
-        n42_data = xmltodict.parse(data, dict_constructor=dict)["RadInstrumentData"]
-
-        self.uuid = n42_data["@n42DocUUID"]
-        self._populate_rad_instrument_information(n42_data["RadInstrumentInformation"]["RadInstrumentIdentifier"])
-
-        # XML transports entities as a dict for a single item, or a list of dicts. Ugh.
-        if isinstance(n42_data["EnergyCalibration"], list):
-            energy_calibrations = {x["@id"]: x["CoefficientValues"] for x in n42_data["EnergyCalibration"]}
+        if hasattr(data, "read"):
+            root = ET.parse(data).getroot()
         else:
-            energy_calibrations = {
-                n42_data["EnergyCalibration"]["@id"]: n42_data["EnergyCalibration"]["CoefficientValues"]
-            }
+            root = ET.fromstring(data)
 
-        if isinstance(n42_data["RadMeasurement"], list):
-            rmz = n42_data["RadMeasurement"]
-        else:
-            rmz = [n42_data["RadMeasurement"]]
+        self.uuid = root.get("n42DocUUID")
+        self._populate_rad_instrument_information(
+            root.findtext("n42:RadInstrumentInformation/n42:RadInstrumentIdentifier", "", _n42_ns).strip()
+        )
+
+        energy_calibrations = {
+            ec.get("id"): ec.findtext("n42:CoefficientValues", "", _n42_ns)
+            for ec in root.iterfind("n42:EnergyCalibration", _n42_ns)
+        }
 
-        for rm in rmz:
+        for rm in root.iterfind("n42:RadMeasurement", _n42_ns):
             sl = self._spectrum_layer_from_rad_measurement(rm, energy_calibrations)
-            mc = rm["MeasurementClassCode"]
+            mc = rm.findtext("n42:MeasurementClassCode", "", _n42_ns).strip()
             if mc == "Foreground":
                 self.spectrum_data.fg_spectrum = sl
             elif mc == "Background":
@@ -11,9 +11,11 @@ utility library, rather than being imported from and between scripts.
 
 import os
 from datetime import datetime, timedelta, timezone
-from re import search as re_search
+from re import compile as re_compile
 from typing import Any, Dict, List
 
+import numpy as np
+from numpy.polynomial.polynomial import polyval
 from radiacode import RadiaCode
 
 from rctypes import Number, SpecData, Spectrum
@@ -27,6 +29,10 @@ _filetime_epoch_offset = 116444736000000000
 
 UTC = timezone(timedelta(0))
 
+_fw_signature_re = re_compile(
+    r'Signature: (?P<fw_signature>[0-9A-F]{8}), FileName="(?P<fw_file>.+?)", IdString="(?P<product>.+?)"'
+)
+
 
 def FileTime2UnixTime(x: Number) -> float:
     "Convert a FileTime to Unix timestamp"
@@ -50,9 +56,39 @@ def DateTime2FileTime(dt: datetime) -> int:
 
 def stringify(a: List[Any], c: str = " ") -> str:
     "Make a string out of a list of things, nicer than str(list(...))"
+    if isinstance(a, np.ndarray):
+        a = a.tolist()  # formatting python scalars is several times faster than formatting numpy scalars
     return c.join([f"{x}" for x in a])
 
 
+# get_dose_from_spectrum is called once per poll, almost always with the same number of channels
+_channel_numbers: Dict[int, np.ndarray] = {}
+
+
+def get_energy_axis(channels: int, a0: float = 0, a1: float = 3000 / 1024, a2: float = 0) -> np.ndarray:
+    "Compute the energy in keV of each channel from the calibration coefficients"
+    if channels not in _channel_numbers:
+        _channel_numbers[channels] = np.arange(channels, dtype=np.float64)
+    return polyval(_channel_numbers[channels], (a0, a1, a2))
+
+
+def get_dose_from_counts(energy_axis: np.ndarray, counts: List[int], d: float = 4.51, v: float = 1.0) -> float:
+    """
+    Estimate the dose represented by a spectrum, given its energy axis from get_energy_axis().
+
+    Calibration doesn't change while polling a device, so the energy axis can be computed once
+    and reused for every spectrum.
+    """
+
+    joules_per_keV = 1.60218e-16
+    mass = d * v * 1e-3  # kg
+
+    total_keV = float(energy_axis @ np.asarray(counts, dtype=np.float64))
+    gray = total_keV * joules_per_keV / mass
+    uSv = gray * 1e6
+    return uSv
+
+
 def get_dose_from_spectrum(
     counts: List[int],
     a0: float = 0,
@@ -69,17 +105,7 @@ def get_dose_from_spectrum(
     d: density in g/cm^3 of the scintillator crystal, approximately 4.51 for CsI:Tl
     v: volume of the scintillator crystal, radiacode is 1cm^3
     """
-
-    joules_per_keV = 1.60218e-16
-    mass = d * v * 1e-3  # kg
-
-    def _chan2kev(c):
-        return a0 + a1 * c + a2 * c**2
-
-    total_keV = sum([_chan2kev(ch) * n for ch, n in enumerate(counts)])
-    gray = total_keV * joules_per_keV / mass
-    uSv = gray * 1e6
-    return uSv
+    return get_dose_from_counts(get_energy_axis(len(counts), a0, a1, a2), counts, d, v)
 
 
 def find_radiacode_devices() -> List[str]:
@@ -101,12 +127,7 @@ def get_device_id(dev: RadiaCode) -> Dict[str, str]:
         "hw_num": dev.hw_serial_number(),
         "sernum": dev.serial_number(),
     }
-    f = re_search(
-        r'Signature: (?P<fw_signature>[0-9A-F]{8}), FileName="(?P<fw_file>.+?)", IdString="(?P<product>.+?)"',
-        rv["fw"],
-    ).groupdict()
-    rv.update(f)
-    rv.pop("fw")
+    rv.update(_fw_signature_re.search(rv.pop("fw")).groupdict())
 
     bv, fv = rv.pop("fv")
     rv["boot_ver"] = f"{bv[0]}.{bv[1]}"
@@ -10,6 +10,8 @@ from argparse import Namespace
 from tempfile import mkstemp
 from unittest.mock import patch
 
+import numpy as np
+
 import calibrate
 
 
@@ -79,15 +81,29 @@ class TestCalibrate(unittest.TestCase):
 
         pf = calibrate.make_fit(chan, energy, args)
         self.assertEqual(calibrate.make_fit(chan, energy, args), expected_fit)
+        self.assertEqual(calibrate.make_fit(cal[:, 0], cal[:, 1], args), expected_fit)
 
         rsq = calibrate.rsquared(chan, energy, pf)
         self.assertAlmostEqual(rsq, expected_rsq, delta=0.0001)
+        # main() hands over the columns of the calibration array directly
+        self.assertEqual(calibrate.rsquared(cal[:, 0], cal[:, 1], pf), rsq)
 
         with patch("sys.argv", [__file__, "-f", cal_file]):
             self.assertIsNone(calibrate.main())
 
         os.unlink(cal_file)
 
+    def test_load_calibration_zero_start(self):
+        fd, cal_file = mkstemp(prefix="pytest")
+        with os.fdopen(fd, "w") as ofd:
+            json.dump({"x": [{"channel": 20, "energy": 60}, {"channel": 0, "energy": 2}]}, ofd)
+
+        # the zero point is only added if there isn't already a measurement at channel 0
+        cal = calibrate.load_calibration(Namespace(cal_file=cal_file, zero_start=True))
+        self.assertEqual(cal.tolist(), [[0, 2], [20, 60]])
+
+        os.unlink(cal_file)
+
     def test_main_file(self):
         with self.assertRaises(SystemExit):
             with patch("sys.argv", [__file__, "-f", "/dev/null"]):
@@ -95,3 +111,19 @@ class TestCalibrate(unittest.TestCase):
         with self.assertRaises(SystemExit):
             with patch("sys.argv", [__file__, "-f", "./nonexistent"]):
                 calibrate.main()
+
+    def test_rsquared_biased_fit(self):
+        # a perfectly correlated but offset model is not a perfect fit
+        chan = [1, 2, 3, 4, 5]
+        energy = [2, 4, 6, 8, 10]
+        self.assertAlmostEqual(calibrate.rsquared(chan, energy, [0, 2]), 1.0)
+        self.assertLess(calibrate.rsquared(chan, energy, [1, 2]), 1.0)
+
+    def test_rsquared_least_squares_fit(self):
+        # for a least squares fit, 1 - SSres/SStot is the same as the squared correlation
+        chan = np.array([10, 20, 30, 40, 50, 60], dtype=np.float64)
+        energy = np.array([31, 58, 92, 118, 152, 177], dtype=np.float64)
+        args = Namespace(order=1, precision=12)
+        pf = calibrate.make_fit(chan, energy, args)
+        r = np.corrcoef(energy, np.polynomial.polynomial.polyval(chan, pf))[0, 1]
+        self.assertAlmostEqual(calibrate.rsquared(chan, energy, pf), r**2)
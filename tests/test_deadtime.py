@@ -86,6 +86,18 @@ class TestDeadTime(unittest.TestCase):
         self.assertAlmostEqual(dt.loss_fraction, self.expected_loss_fraction, delta=1e-3)
         self.assertAlmostEqual(dt.lost_cps, self.expected_lost_cps, delta=0.5)
 
+    def test_get_rate_from_spectrum(self):
+        self.assertAlmostEqual(deadtime.get_rate_from_spectrum(self.f_bg), 5.267, places=3)
+        self.assertAlmostEqual(deadtime.get_rate_from_spectrum(self.f_a), 692.267, places=3)
+        with patch("deadtime.RcSpectrum") as rcs:
+            deadtime.get_rate_from_spectrum(self.f_bg)
+            rcs.assert_not_called()
+
+    def test_as_rate(self):
+        self.assertEqual(deadtime._as_rate("600", 2), 300)
+        self.assertEqual(deadtime._as_rate(".5e3", 10), 50)
+        self.assertAlmostEqual(deadtime._as_rate(self.f_bg, 10), 5.267, places=3)
+
     def test_get_args_fail(self):
         with patch("sys.argv", [__file__, "-a", self.f_a, "-b", self.f_b, "-g", self.f_bg]):
             with self.assertRaises(SystemExit):
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 syn=python
+# SPDX-License-Identifier: MIT
+
+import unittest
+from unittest.mock import Mock
+
+import gpsled
+
+
+class TestGpsLed(unittest.TestCase):
+    def test_is_tpv(self):
+        self.assertTrue(gpsled._is_tpv(b'{"class":"TPV","mode":3}'))
+        self.assertTrue(gpsled._is_tpv(b'{"class": "TPV", "mode": 3}'))
+        self.assertFalse(gpsled._is_tpv(b'{"class":"SKY","satellites":[]}'))
+
+    def _lines(self, *chunks):
+        sock = Mock()
+        sock.recv.side_effect = list(chunks) + [b""]
+        return list(gpsled._read_lines(sock))
+
+    def test_read_lines_split_across_recv(self):
+        self.assertEqual(self._lines(b'{"class":', b'"TPV"}\n'), [b'{"class":"TPV"}', b""])
+
+    def test_read_lines_several_per_recv(self):
+        self.assertEqual(self._lines(b"one\ntwo\nthr", b"ee\n"), [b"one", b"two", b"three", b""])
+
+    def test_read_lines_blank_lines(self):
+        self.assertEqual(self._lines(b"\none\n\n\ntwo\n"), [b"one", b"two", b""])
+
+    def test_read_lines_eof(self):
+        sock = Mock()
+        sock.recv.side_effect = [b"one\npartial", b"", AssertionError("read after EOF")]
+        self.assertEqual(list(gpsled._read_lines(sock)), [b"one", b""])
+        self.assertEqual(sock.recv.call_count, 2)
@@ -3,11 +3,14 @@
 # vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 syn=python
 # SPDX-License-Identifier: MIT
 
+import os
 import sys
 import unittest
 from io import StringIO
 from os.path import dirname
 from os.path import join as pathjoin
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
 from unittest.mock import patch
 
 import n42convert
@@ -103,6 +106,46 @@ class TestN42Convert(unittest.TestCase):
         self.assertIn("Title: BG 35hr", converted)
         self.assertIn("radiacode-csi-sipm", converted)
 
+    def test_same_fg_and_bg_file(self):
+        fn = pathjoin(testdir, "data_th232_plus_background.xml")
+        with patch("n42convert.RcSpectrum", wraps=n42convert.RcSpectrum) as rcs:
+            with patch("sys.stdout", new_callable=StringIO):
+                n42convert.process_single_file(fn, bg_file=fn, out_file="/dev/stdout", overwrite=True)
+            converted = sys.stdout.read()
+        rcs.assert_called_once_with(fn)
+        self.assertIn("<Remark>BG 35hr</Remark>", converted)
+
+    def _recursive_input(self) -> str:
+        "Make a scratch directory of spectra to convert, which is removed after the test"
+        tmpdir = mkdtemp(prefix="pytest_n42convert_")
+        self.addCleanup(rmtree, tmpdir)
+        for fn in ["data_am241.xml", "data_th232_plus_background.xml"]:
+            copyfile(pathjoin(testdir, fn), pathjoin(tmpdir, fn))
+        return tmpdir
+
+    def test_main_recursive(self):
+        tmpdir = self._recursive_input()
+        with patch("n42convert.ProcessPoolExecutor", wraps=n42convert.ProcessPoolExecutor) as pool:
+            for jobs in ["16", "1"]:
+                with patch("sys.argv", [__file__, "-r", "-j", jobs, "-i", tmpdir]):
+                    n42convert.main()
+        # no more workers than there are files
+        pool.assert_called_once_with(max_workers=2)
+        self.assertTrue(os.path.exists(pathjoin(tmpdir, "data_am241.xml.n42")))
+        self.assertTrue(os.path.exists(pathjoin(tmpdir, "data_th232_plus_background.xml.n42")))
+
+    def test_main_recursive_keeps_existing(self):
+        tmpdir = self._recursive_input()
+        for fn in os.listdir(tmpdir):
+            with open(pathjoin(tmpdir, fn + ".n42"), "w") as ofd:
+                ofd.write("sentinel")
+        for jobs in ["2", "1"]:
+            with patch("sys.argv", [__file__, "-r", "-j", jobs, "-i", tmpdir]):
+                n42convert.main()
+            for fn in ["data_am241.xml.n42", "data_th232_plus_background.xml.n42"]:
+                with open(pathjoin(tmpdir, fn)) as ifd:
+                    self.assertEqual(ifd.read(), "sentinel")
+
     def test_structure_fail(self):
         with self.assertRaises(Exception):
             n42convert.load_radiacode_spectrum("/dev/null")
@@ -122,6 +165,31 @@ class TestN42Convert(unittest.TestCase):
         with self.assertRaises(ValueError):
             n42convert.squareformat([0], 0)
 
+    def test_format_output(self):
+        data = n42convert.format_output(
+            detector_info=n42convert.make_detector_info(),
+            instrument_info="<RadInstrumentInformation/>",
+            fg_cal="<EnergyCalibration/>",
+            fg_spectrum="<RadMeasurement/>",
+            uuid=self.u,
+        )
+        self.assertTrue(data.startswith('<?xml version="1.0"?>'))
+        self.assertIn(f'n42DocUUID="{self.u}"', data)
+        self.assertIn('<RadDetectorInformation id="radiacode-csi-sipm">', data)
+        self.assertTrue(data.endswith("</RadInstrumentData>"))
+
+    def test_write_output(self):
+        parts = dict(
+            detector_info=n42convert.make_detector_info(),
+            instrument_info="<RadInstrumentInformation/>",
+            fg_cal="<EnergyCalibration/>",
+            fg_spectrum="<RadMeasurement/>",
+            uuid=self.u,
+        )
+        ofd = StringIO()
+        n42convert.write_output(ofd, **parts)
+        self.assertEqual(ofd.getvalue(), n42convert.format_output(**parts) + "\n")
+
     def test_argparse_no_uuid(self):
         with patch("sys.argv", [__file__, "-i", self.i, "-b", self.b, "-o", self.o]):
             parsed_args = n42convert.get_args()
@@ -6,10 +6,12 @@
 
 import os
 import unittest
+from io import StringIO
 from os.path import dirname
 from os.path import join as pathjoin
-from tempfile import mkstemp
-from unittest.mock import patch
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp, mkstemp
+from unittest.mock import Mock, patch
 
 import n42validate
 
@@ -25,6 +27,36 @@ class TestN42Validate(unittest.TestCase):
         schema = n42validate.fetch_or_load_xsd(schema_file=self.schema_file)
         self.assertIsNotNone(schema)
 
+    def _schema_copy(self) -> str:
+        "Copy the test schema into a scratch directory, which is removed along with the pickle after the test"
+        tmpdir = mkdtemp(prefix="pytest_n42validate_")
+        self.addCleanup(rmtree, tmpdir)
+        return copyfile(self.schema_file, pathjoin(tmpdir, "n42.xsd"))
+
+    def test_schema_pickle_cache(self):
+        tfn = self._schema_copy()
+
+        schema = n42validate.fetch_or_load_xsd(schema_file=tfn)
+        self.assertTrue(os.path.exists(tfn + ".pickle"))
+        # in-process calls are served from memory
+        self.assertIs(n42validate.fetch_or_load_xsd(schema_file=tfn), schema)
+        # a new process would load the pickle
+        n42validate.load_schema.cache_clear()
+        schema = n42validate.fetch_or_load_xsd(schema_file=tfn)
+        self.assertTrue(schema.is_valid(n42validate.ET.parse(self.n42_file)))
+
+    def test_schema_pickle_untrusted(self):
+        tfn = self._schema_copy()
+        n42validate.fetch_or_load_xsd(schema_file=tfn)
+        n42validate.load_schema.cache_clear()
+
+        # someone else could have replaced this pickle, so it must be rebuilt rather than loaded
+        os.chmod(tfn + ".pickle", 0o666)
+        with patch("pickle.load") as pickle_load:
+            self.assertIsNotNone(n42validate.fetch_or_load_xsd(schema_file=tfn))
+        pickle_load.assert_not_called()
+        self.assertEqual(os.stat(tfn + ".pickle").st_mode & 0o077, 0)
+
     def test_schema_fetch(self):
         with open(self.schema_file, "r") as fd:
             schema_text = fd.read()
@@ -45,6 +77,48 @@ class TestN42Validate(unittest.TestCase):
             self.assertIsNotNone(schema)
             os.unlink(tfn)
 
+    def test_schema_refresh_not_modified(self):
+        tfn = self._schema_copy()
+        mtime = os.path.getmtime(tfn)
+        request_headers = {}
+
+        def mocked_requests_get(*args, **kwargs):
+            class MockResponse:
+                def __init__(self):
+                    self.status_code = 304
+                    self.ok = False
+                    self.text = ""
+
+            request_headers.update(kwargs["headers"])
+            return MockResponse()
+
+        with patch("requests.get", mocked_requests_get):
+            schema = n42validate.fetch_or_load_xsd(schema_file=tfn, refresh=True)
+        self.assertIsNotNone(schema)
+        self.assertIn("If-Modified-Since", request_headers)
+        self.assertEqual(os.path.getmtime(tfn), mtime)
+
+    def test_schema_refresh_server_error(self):
+        tfn = self._schema_copy()
+
+        with patch("requests.get", return_value=Mock(status_code=503, ok=False, text="")):
+            with patch("sys.stderr", new_callable=StringIO) as stderr:
+                self.assertIsNotNone(n42validate.fetch_or_load_xsd(schema_file=tfn, refresh=True))
+        self.assertIn("using cached copy: HTTP 503", stderr.getvalue())
+
+    def test_schema_refresh_network_error(self):
+        tfn = self._schema_copy()
+
+        with patch("requests.get", side_effect=n42validate.requests.ConnectionError("no network")):
+            with patch("sys.stderr", new_callable=StringIO) as stderr:
+                schema = n42validate.fetch_or_load_xsd(schema_file=tfn, refresh=True)
+            self.assertIsNotNone(schema)
+            self.assertIn("using cached copy", stderr.getvalue())
+
+            # without a cached copy, there's nothing to fall back on
+            with self.assertRaises(n42validate.requests.ConnectionError):
+                n42validate.fetch_or_load_xsd(schema_file=tfn + ".missing", refresh=True)
+
     def test_schema_fetch_fail(self):
         def mocked_requests_get(*args, **kwargs):
             class MockResponse:
@@ -59,6 +133,13 @@ class TestN42Validate(unittest.TestCase):
             with self.assertRaises(RuntimeError):
                 n42validate.fetch_or_load_xsd(schema_file="./nonexistent")
 
+    def test_validate_file(self):
+        self.assertEqual(n42validate.validate_file(self.schema_file, self.n42_file), (True, ""))
+        valid, reason = n42validate.validate_file(self.schema_file, self.bad_file)
+        self.assertFalse(valid)
+        self.assertIn("Reason:", reason)
+        self.assertEqual(n42validate.validate_file(self.schema_file, self.bad_file, details=False), (False, ""))
+
     def test_argparse_fail(self):
         with self.assertRaises(SystemExit):
             n42validate.get_args()
@@ -86,6 +167,26 @@ class TestN42Validate(unittest.TestCase):
         with patch("sys.argv", [__file__, "-s", self.schema_file, "--recursive", "--valid-only", "--verbose", testdir]):
             n42validate.main()
 
+    def test_main_parallel(self):
+        output = []
+        for jobs in ["1", "2"]:
+            argv = [__file__, "-s", self.schema_file, "-j", jobs, "--verbose", self.n42_file, self.bad_file]
+            with patch("sys.argv", argv), patch("sys.stdout", new_callable=StringIO) as stdout:
+                n42validate.main()
+            # the error details include object addresses, so only compare the status lines
+            output.append([line for line in stdout.getvalue().splitlines() if line.startswith("[")])
+        self.assertEqual(output[0], output[1])
+        self.assertEqual(output[1], [f"[VALID] {self.n42_file}", f"[ERROR] {self.bad_file}"])
+
+    def test_main_pool_size(self):
+        with patch("n42validate.ProcessPoolExecutor", wraps=n42validate.ProcessPoolExecutor) as pool:
+            for files in [[self.n42_file], [self.n42_file, self.bad_file]]:
+                with patch("sys.argv", [__file__, "-s", self.schema_file, "-q", "-j", "16"] + files):
+                    with patch("sys.stdout", new_callable=StringIO):
+                        n42validate.main()
+        # a single file is validated in process, and two files don't need sixteen workers
+        pool.assert_called_once_with(max_workers=2)
+
     def test_main_recursive_quiet(self):
         with patch("sys.argv", [__file__, "-s", self.schema_file, "--recursive", "--quiet", testdir]):
             n42validate.main()
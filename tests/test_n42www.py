@@ -25,7 +25,8 @@ class TestN42Www(unittest.TestCase):
 
     def test_index(self):
         p = n42www.handle_index()
-        self.assertIn("Radiacode", p)
+        self.assertEqual(p.mimetype, "text/html")
+        self.assertIn("Radiacode", p.get_data(as_text=True))
 
     def test_argparse_no_args(self):
         with patch("sys.argv", [__file__]):
@@ -59,6 +60,26 @@ class TestN42Www(unittest.TestCase):
             self.assertIn(dfn, str(response.headers))
             self.assertIn('radDetectorInformationReference="radiacode-csi-sipm"', response.get_data(as_text=True))
 
+    def test_convert_filename(self):
+        with open(pathjoin(testdir, "data_am241.xml"), "rb") as am241:
+            response = self.client.post("/convert", data={"file-input": (am241, "../my am!!241__spectrum.xml")})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("filename=my_am_241_spectrum.n42", str(response.headers))
+
+    def test_convert_cached(self):
+        n42www._convert.cache_clear()
+        for _ in range(2):
+            with open(pathjoin(testdir, "data_am241.xml"), "rb") as am241:
+                response = self.client.post("/convert", data={"file-input": (am241, "data_am241.xml")})
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(n42www._convert.cache_info().hits, 1)
+
+    def test_convert_content_length(self):
+        with open(pathjoin(testdir, "data_am241.xml"), "rb") as am241:
+            response = self.client.post("/convert", data={"file-input": (am241, "data_am241.xml")})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content_length, len(response.get_data()))
+
     def test_convert_bad_field(self):
         fn = "data_am241.xml"
         with open("/dev/null", "rb") as am241:
@@ -4,18 +4,22 @@
 # SPDX-License-Identifier: MIT
 
 import datetime
+import os
 import sys
 import unittest
 from io import StringIO
 from os.path import dirname
 from os.path import join as pathjoin
+from shutil import rmtree
+from signal import SIGINT, default_int_handler, getsignal
+from tempfile import mkdtemp
 from unittest.mock import patch
 
 from radiacode.types import Spectrum
 
 import radiacode_poll
-from n42convert import load_radiacode_spectrum
-from rcutils import get_device_id, get_dose_from_spectrum
+from rcfiles import RcSpectrum
+from rcutils import get_device_id, get_dose_from_counts, get_dose_from_spectrum, get_energy_axis
 
 # Approximately when I started writing this; used to give a stable start time
 test_epoch = datetime.datetime(2023, 10, 13, 13, 13, 13)
@@ -30,15 +34,13 @@ class MockRadiaCode:
     hsn = "0035001C-464B5009-20393153"
     conn_time = test_epoch
 
-    th_data = load_radiacode_spectrum(pathjoin(testdir, "data_th232_plus_background.xml"))
-    sn = th_data["foreground"]["device_serial_number"]
-    a0 = th_data["foreground"]["calibration_values"][0]
-    a1 = th_data["foreground"]["calibration_values"][1]
-    a2 = th_data["foreground"]["calibration_values"][2]
+    th_data = RcSpectrum(pathjoin(testdir, "data_th232_plus_background.xml"))
+    sn = th_data.fg_spectrum.serial_number
+    a0, a1, a2 = th_data.fg_spectrum.calibration
     real_time = 0
 
-    th232_duration = th_data["foreground"]["duration"]
-    th232 = th_data["foreground"]["spectrum"]
+    th232_duration = th_data.fg_spectrum.duration.total_seconds()
+    th232 = th_data.fg_spectrum.counts
     th232_cps = sum(th232) / th232_duration
     counts = [0] * len(th232)
 
@@ -98,11 +100,27 @@ class TestRadiaCodePoll(unittest.TestCase):
             args = radiacode_poll.get_args()
             self.assertTrue(args.url)
 
+    def test_get_args_accumulate_time(self):
+        for t, expected in [("01:30:05", 5405), ("1:30", 5400), ("90", 90), ("90s", 90), ("1h30m", 5400)]:
+            with patch("sys.argv", [__file__, "--accumulate-time", t]):
+                self.assertEqual(radiacode_poll.get_args().accumulate_time, expected)
+
+        for t in ["0", "", "1:2:3:4", "tomorrow"]:
+            with patch("sys.argv", [__file__, "--accumulate-time", t]), patch("sys.stderr", new_callable=StringIO):
+                with self.assertRaises(SystemExit):
+                    radiacode_poll.get_args()
+
     def test_format_spectrum(self):
         dev = MockRadiaCode()
 
         devid = get_device_id(dev)
         self.assertIn("RC-102", devid["sernum"])
+        self.assertEqual(devid["fw_signature"], "57353F42")
+        self.assertEqual(devid["fw_file"], "rc-102.bin")
+        self.assertEqual(devid["product"], "RadiaCode RC-102")
+        self.assertEqual(devid["boot_ver"], "4.0")
+        self.assertEqual(devid["fw_ver"], "4.9")
+        self.assertEqual(devid["fw_date"], "Jan 25 2024 14:49:00")
 
         instrument_info = radiacode_poll.make_instrument_info(devid)
         self.assertIn("python-radiacode", instrument_info)
@@ -121,6 +139,8 @@ class TestRadiaCodePoll(unittest.TestCase):
             counts=dev.th232,
         )
         self.assertAlmostEqual(303.20, get_dose_from_spectrum(s.counts, s.a0, s.a1, s.a2), delta=0.01)
+        energy_axis = get_energy_axis(len(s.counts), s.a0, s.a1, s.a2)
+        self.assertAlmostEqual(303.20, get_dose_from_counts(energy_axis, s.counts), delta=0.01)
 
     def test_main(self):
         with patch("sys.stdout", new_callable=StringIO):
@@ -130,3 +150,36 @@ class TestRadiaCodePoll(unittest.TestCase):
         expected = "RADDATA://G0/0400/6BFH"
         fake_stdout = sys.stdout.read(len(expected))
         # self.assertIn(expected, fake_stdout)
+
+    def test_main_outfile_cleanup(self):
+        tmpdir = mkdtemp(prefix="pytest_radiacode_poll_")
+        self.addCleanup(rmtree, tmpdir)
+        outfile = pathjoin(tmpdir, "out.n42")
+        with patch("sys.stdout", new_callable=StringIO), patch("sys.stderr", new_callable=StringIO):
+            with patch("radiacode.RadiaCode", MockRadiaCode), patch("sys.argv", [__file__, outfile]):
+                with patch("os.replace", side_effect=OSError("cross-device link")):
+                    with self.assertRaises(OSError):
+                        radiacode_poll.main()
+                self.assertEqual(os.listdir(tmpdir), [])
+                radiacode_poll.main()
+        self.assertEqual(os.listdir(tmpdir), ["out.n42"])
+
+    def test_main_accumulate_interrupted(self):
+        # ^C during a poll ends the accumulation as soon as that poll is done
+        handlers = []
+        mock_spectrum = MockRadiaCode.spectrum
+
+        def spectrum(dev):
+            handlers.append(getsignal(SIGINT))
+            if len(handlers) == 2:  # the first poll inside the accumulation loop
+                handlers[-1](SIGINT, None)
+            return mock_spectrum(dev)
+
+        with patch("sys.stdout", new_callable=StringIO), patch("sys.stderr", new_callable=StringIO):
+            with patch("radiacode.RadiaCode", MockRadiaCode), patch.object(MockRadiaCode, "spectrum", spectrum):
+                with patch("sys.argv", [__file__, "--accumulate-dose", "1e9"]):
+                    radiacode_poll.main()
+        # the initial spectrum, the interrupted poll, and the final spectrum
+        self.assertEqual(len(handlers), 3)
+        self.assertIsNot(handlers[1], default_int_handler)
+        self.assertIs(getsignal(SIGINT), default_int_handler)
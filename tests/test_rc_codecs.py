@@ -57,6 +57,11 @@ class TestRcCodecs(unittest.TestCase):
         for x in self.b45_pairs:
             self.assertEqual(rc_codecs.b45_encode(x[0].decode()), x[1])
 
+    def test_b45_encode_short(self):
+        self.assertEqual(rc_codecs.b45_encode(b""), "")
+        self.assertEqual(rc_codecs.b45_encode(b"\xff"), "U5")
+        self.assertEqual(rc_codecs.b45_encode(bytearray(b"ietf!")), "QED8WEX0")
+
     def test_b45_decode_fail_bad_char(self):
         with self.assertRaises(ValueError) as cm:
             _ = rc_codecs.b45_decode("BB^")
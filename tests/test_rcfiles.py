@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 syn=python
+# SPDX-License-Identifier: MIT
+
+import unittest
+
+import rcfiles
+
+
+class TestRcFiles(unittest.TestCase):
+    def test_parse_counts(self):
+        self.assertEqual(rcfiles._parse_counts(" 1 2\n  30\t4 "), [1, 2, 30, 4])
+        self.assertEqual(rcfiles._parse_counts(""), [])
+
+    def test_parse_counts_fail_bad_count(self):
+        with self.assertRaises(ValueError):
+            rcfiles._parse_counts("1 2 x 4")
+        with self.assertRaises(ValueError):
+            rcfiles._parse_counts("1 2.5 3")
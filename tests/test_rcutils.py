@@ -6,6 +6,8 @@
 import datetime
 import unittest
 
+import numpy as np
+
 from rcutils import (
     DateTime2FileTime,
     FileTime2DateTime,
@@ -50,6 +52,7 @@ class TestRadiaCodeUtils(unittest.TestCase):
         for t in testcases:
             self.assertEqual(stringify(t[0]), t[1])
             self.assertEqual(stringify(t[0], ","), t[1].replace(" ", ","))
+            self.assertEqual(stringify(np.array(t[0], dtype=int)), t[1])
 
     def test_get_device_info(self):
         dev = MockRadiaCode()